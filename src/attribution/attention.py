@@ -1,30 +1,32 @@
 import torch
-from collections import defaultdict
 from typing import Dict, List, Tuple
 
 from model.model import GenerationModel
 from attribution.utils import (
-    find_target_token_span,
-    find_field_token_span,
+    TokenizedItem,
+    tokenize_item,
+    check_runtime_eager,
+    get_attention_weights,
     aggregate_attributions_target,
-    aggregate_attributions_word
+    aggregate_attributions_word,
+    rank_word_attributions
 )
 
-from nltk.corpus import stopwords
-
-STOPWORDS = set(stopwords.words('english'))
-
 
 class AttentionAttribution:
+    requires_raw_model = True
+    
     def __init__(
             self,
             model: GenerationModel,
             dataset: str,
             aggregation: str = "last",
             target_agg_method: str = "abs_mean",
-            word_agg_method: str = "sum"
+            word_agg_method: str = "sum",
+            streaming: bool = False
     ):
         self.model = model
+        self.streaming = streaming
         self.dataset = dataset
         self.aggregation = aggregation
         self.target_agg_method = target_agg_method
@@ -42,81 +44,31 @@ class AttentionAttribution:
     ) -> Dict:
         item['aiw_attn_feedback'] = {}
         
-        input_text = self.model.get_formatted_prompt(item["answer"]["prompt"])
-        generated_text = item["answer"]["outputs"][0]
-        target_text = item["answer"]["final"]
-        input_len = self.model.tokenizer(input_text, return_tensors="pt", add_special_tokens=False)["input_ids"].size(1)
+        tokenized = tokenize_item(item, self.model, self.field_map[self.dataset])
         
-        target_attr_res = self._compute_attention(input_text, generated_text, target_text)
-        formatted_target_attr_res = [attr_res[:input_len] for attr_res in target_attr_res]
+        compute_attention = self._compute_attention_streaming if self.streaming else self._compute_attention
+        target_attr_res = compute_attention(tokenized)
+        formatted_target_attr_res = [attr_res[:tokenized.input_len] for attr_res in target_attr_res]
         aggregated_target_attr_res = aggregate_attributions_target(formatted_target_attr_res, self.target_agg_method)
         
         for field in self.field_map[self.dataset]:
-            field_start, field_end = find_field_token_span(input_text, item[field], self.model)
+            field_start, field_end = tokenized.field_spans[field]
             field_tokens = aggregated_target_attr_res[field_start: field_end + 1]
             item['aiw_attn_feedback'][field] = aggregate_attributions_word(field_tokens, self.word_agg_method)
             
-        all_word_score_pairs = []
-        merged_word_score_pairs = defaultdict(float)
-        for field in self.field_map[self.dataset]:
-            word_score_pair = item['aiw_attn_feedback'][field]
-            for word, score in zip(word_score_pair['words'], word_score_pair['scores']):
-                word = word.lower()
-                all_word_score_pairs.append((word, score))
-                merged_word_score_pairs[word] += score
-                
-        all_sorted_word_score_pairs = sorted(all_word_score_pairs, key=lambda x: x[1], reverse=True)
-        item['aiw_attn_feedback']['all_sorted'] = {
-            "words": [word for word, _ in all_sorted_word_score_pairs],
-            "scores": [score for _, score in all_sorted_word_score_pairs]
-        }
-        
-        merged_sorted_word_score_pairs = sorted(merged_word_score_pairs.items(), key=lambda x: x[1], reverse=True)
-        item['aiw_attn_feedback']['merged_sorted'] = {
-            "words": [word for word, _ in merged_sorted_word_score_pairs],
-            "scores": [score for _, score in merged_sorted_word_score_pairs]
-        }
-        
-        all_filtered_word_score_pairs = []
-        for word, score in all_sorted_word_score_pairs:
-            if word not in STOPWORDS:
-                all_filtered_word_score_pairs.append((word, score))
-                
-        merged_filtered_word_score_pairs = []
-        for word, score in merged_sorted_word_score_pairs:
-            if word not in STOPWORDS:
-                merged_filtered_word_score_pairs.append((word, score))
-                
-        item['aiw_attn_feedback']['all_filtered'] = {
-            "words": [word for word, _ in all_filtered_word_score_pairs],
-            "scores": [score for _, score in all_filtered_word_score_pairs]
-        }
-        
-        item['aiw_attn_feedback']['merged_filtered'] = {
-            "words": [word for word, _ in merged_filtered_word_score_pairs],
-            "scores": [score for _, score in merged_filtered_word_score_pairs]
-        }
+        rank_word_attributions(item['aiw_attn_feedback'], self.field_map[self.dataset])
         
         return item
     
     def _compute_attention(
             self,
-            input_text: str,
-            generated_text: str,
-            target_text: str
+            tokenized: TokenizedItem
     ) -> List[List[Tuple[int, str, float]]]:
         
-        full_text = input_text + generated_text
-        inputs = self.model.tokenizer(full_text, return_tensors="pt", add_special_tokens=False).to(self.model.device)
-        input_ids = inputs["input_ids"]
-        attention_mask = inputs["attention_mask"]
+        input_ids = torch.tensor([tokenized.input_ids], device=self.model.device)
+        attention_mask = torch.ones_like(input_ids)
         
-        target_start, target_end = find_target_token_span(
-            input_text,
-            generated_text,
-            target_text,
-            self.model
-        )
+        target_start, target_end = tokenized.target_span
         
         with torch.no_grad():
             outputs = self.model.model(
@@ -144,11 +96,76 @@ class AttentionAttribution:
             
             scores = avg_attn[target_token_pos, :].detach().cpu().numpy()
             
-            tokens = self.model.tokenizer.convert_ids_to_tokens(input_ids.squeeze(0))
-            token_ids = self.model.tokenizer.convert_tokens_to_ids(tokens)
+            result = []
+            for token_id, token, score in zip(tokenized.input_ids, tokenized.tokens, scores):
+                result.append((token_id, token, score))
+                
+            target_attribution_results.append(result)
+            
+        return target_attribution_results
+    
+    def _compute_attention_streaming(
+            self,
+            tokenized: TokenizedItem
+    ) -> List[List[Tuple[int, str, float]]]:
+        
+        input_ids = torch.tensor([tokenized.input_ids], device=self.model.device)
+        attention_mask = torch.ones_like(input_ids)
+        
+        target_start, target_end = tokenized.target_span
+        target_positions = torch.arange(target_start, target_end + 1, device=input_ids.device)
+        
+        attention_modules = [
+            module for name, module in self.model.model.named_modules() if name.endswith("self_attn")
+        ]
+        if self.aggregation == "last":
+            selected_modules = attention_modules[-1:]
+        elif self.aggregation == "avg":
+            selected_modules = attention_modules
+        else:
+            raise ValueError("Unknown aggregation method: {}".format(self.aggregation))
+        selected_ids = {id(module) for module in selected_modules}
+        
+        # Running sum of the head-averaged attention rows of the target tokens: [T, S]. Eager attention still
+        # builds each layer's full [H, S, S] map while that layer runs; what streaming avoids is keeping one per
+        # layer, so peak memory is a single layer's map rather than O(S) per layer.
+        running_attn = torch.zeros(len(target_positions), input_ids.size(1), dtype=torch.float32, device=input_ids.device)
+        
+        def hook(module, args, output):
+            nonlocal running_attn
+            if id(module) in selected_ids:
+                rows = get_attention_weights(module, output)[0, :, target_positions, :].to(torch.float32).mean(dim=0)
+                running_attn += rows.to(running_attn.device)
+            # Drop the full [B, H, S, S] map so the model does not collect one per layer.
+            return (output[0], None) + tuple(output[2:])
+        
+        # prepend: runs before the output-capturing hooks transformers installs once output_attentions has been used,
+        # so they never see the full map. Eager attention returns the weights without output_attentions=True.
+        handles = [module.register_forward_hook(hook, prepend=True) for module in attention_modules]
+        check_runtime_eager()
+        attn_implementation = self.model.model.config._attn_implementation
+        self.model.model.config._attn_implementation = "eager"
+        try:
+            with torch.no_grad():
+                self.model.model(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    output_attentions=False,
+                    use_cache=False
+                )
+        finally:
+            for handle in handles:
+                handle.remove()
+            self.model.model.config._attn_implementation = attn_implementation
+            
+        avg_rows = running_attn / len(selected_modules)
+        
+        target_attribution_results = []
+        for row in range(avg_rows.size(0)):
+            scores = avg_rows[row].detach().cpu().numpy()
             
             result = []
-            for token_id, token, score in zip(token_ids, tokens, scores):
+            for token_id, token, score in zip(tokenized.input_ids, tokenized.tokens, scores):
                 result.append((token_id, token, score))
                 
             target_attribution_results.append(result)
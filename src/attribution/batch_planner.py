@@ -0,0 +1,97 @@
+import os
+import torch
+from typing import Dict
+
+from model.model import GenerationModel
+
+
+def is_oom_error(e: BaseException) -> bool:
+    if isinstance(e, MemoryError):
+        return True
+    message = str(e)
+    return (
+        'CUDA out of memory' in message
+        or "can't allocate memory" in message
+        or 'not enough memory' in message
+    )
+
+
+def get_available_memory(device: torch.device) -> int:
+    if device.type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 4 * 1024 ** 3
+
+
+class IGBatchPlanner:
+    def __init__(
+            self,
+            model: GenerationModel,
+            bucket_size: int = 64,
+            safety_factor: float = 0.7,
+            max_batch_size: int = 512
+    ):
+        # Model dimensions are read on the first plan, so building the planner does not load the weights.
+        self.model = model
+        self.hidden_size = None
+
+        self.bucket_size = bucket_size
+        self.safety_factor = safety_factor
+        self.max_batch_size = max_batch_size
+
+        # Per sequence-length bucket: the largest size that fit and the smallest size that did not.
+        self.known_good: Dict[int, int] = {}
+        self.known_bad: Dict[int, int] = {}
+
+    def bucket(self, seq_len: int) -> int:
+        return seq_len // self.bucket_size
+
+    def read_model_config(self):
+        config = self.model.model.config
+        self.hidden_size = config.hidden_size
+        self.num_layers = config.num_hidden_layers
+        self.num_heads = config.num_attention_heads
+        self.vocab_size = config.vocab_size
+        self.bytes_per_element = next(self.model.model.parameters()).element_size()
+
+    def estimate_bytes_per_example(self, seq_len: int) -> int:
+        # Activations kept for the backward pass of one transformer layer are about
+        # s * h * (34 + 5 * a * s / h) bytes in 16-bit precision (Korthikanti et al., 2022),
+        # plus the float32 logits over the vocabulary.
+        if self.hidden_size is None:
+            self.read_model_config()
+        bucket_len = (self.bucket(seq_len) + 1) * self.bucket_size
+        per_layer = bucket_len * self.hidden_size * (34 + 5 * self.num_heads * bucket_len / self.hidden_size)
+        activations = self.num_layers * per_layer * self.bytes_per_element / 2
+        logits = bucket_len * self.vocab_size * 4
+        return int(activations + logits)
+
+    def plan(self, seq_len: int, device: torch.device) -> int:
+        # A size that fit before is a lower bound, not a cap: the memory estimate can still allow more.
+        bucket = self.bucket(seq_len)
+        available = get_available_memory(device) * self.safety_factor
+        batch_size = max(self.known_good.get(bucket, 0), int(available // self.estimate_bytes_per_example(seq_len)))
+        if bucket in self.known_bad:
+            batch_size = min(batch_size, self.known_bad[bucket] - 1)
+        return max(1, min(batch_size, self.max_batch_size))
+
+    def record_success(self, seq_len: int, batch_size: int):
+        bucket = self.bucket(seq_len)
+        self.known_good[bucket] = max(self.known_good.get(bucket, 0), batch_size)
+
+    def record_oom(self, seq_len: int, batch_size: int):
+        bucket = self.bucket(seq_len)
+        self.known_bad[bucket] = min(self.known_bad.get(bucket, batch_size), batch_size)
+        if self.known_good.get(bucket, 0) >= batch_size:
+            del self.known_good[bucket]
@@ -0,0 +1,83 @@
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from model.model import GenerationModel
+from modules.answer_generator import parse
+from modules.generator.generator import GeneralGenerator
+from modules.utils import get_prompt_template, is_valid_answer
+from attribution.integrated_gradient import IntegratedGradientsAttribution
+
+
+def main():
+    # Checks that batched IG over all target tokens (feedback.ig.batch_targets=true) agrees with the per-token
+    # path within IntegratedGradientsAttribution.BATCHED_RELATIVE_TOLERANCE, and times both.
+    # e.g. on CPU: -m HuggingFaceTB/SmolLM2-135M-Instruct --dtype float32 --device_map cpu
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model', type=str, default='llama', help="LLM_MODELS key, hub id or local path")
+    parser.add_argument('-d', '--dataset', type=str, default='esnli', choices=['comve', 'ecqa', 'esnli'])
+    parser.add_argument('-n', '--num_items', type=int, default=4)
+    parser.add_argument('-s', '--n_steps', type=int, default=32)
+    parser.add_argument('--dtype', type=str, default='bfloat16')
+    parser.add_argument('--device_map', type=str, default='auto')
+    args = parser.parse_args()
+
+    with open(f"data/formatted/{args.dataset}/test.json", "r", encoding="utf-8") as f:
+        data = json.load(f)[:args.num_items]
+
+    model = GenerationModel(args.model, dtype=args.dtype, device_map=args.device_map)
+
+    # === Answers to attribute ===
+    answer_generator = GeneralGenerator(
+        model=model,
+        generation_args={"do_sample": False, "max_new_tokens": 64},
+        prompt_template=get_prompt_template("zs", args.dataset, "answer"),
+        parse_fn=parse,
+        stage="answer",
+        answer_validator=lambda a: is_valid_answer(a, args.dataset)
+    )
+    items = [item for item in answer_generator.call_batch(data) if item["answer"]["final"] is not None]
+    if not items:
+        raise RuntimeError(f"{args.model} produced no valid answer for the first {args.num_items} items")
+
+    attribution = IntegratedGradientsAttribution(model, args.dataset, args.model)
+    attribution.n_steps = args.n_steps
+
+    # === Batched vs per-token ===
+    failures = 0
+    start = time.perf_counter()
+    for item in items:
+        stats = attribution.compare_batched(item)
+        print(
+            f"idx {item['idx']}: {stats['num_targets']} targets, "
+            f"score diff {stats['relative_diff']:.2e} (max abs {stats['max_abs_diff']:.2e}), "
+            f"delta diff {stats['delta_relative_diff']:.2e} (max abs {stats['max_delta_diff']:.2e})"
+        )
+        failures += not stats["within_tolerance"]
+    compare_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    attribution.batch_targets = False
+    for item in items:
+        attribution(dict(item))
+    per_token_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    attribution.batch_targets = True
+    for item in items:
+        attribution(dict(item))
+    batched_time = time.perf_counter() - start
+
+    print(f"Per-token: {per_token_time:.2f}s, batched: {batched_time:.2f}s ({per_token_time / batched_time:.2f}x), "
+          f"comparison {compare_time:.2f}s")
+    print(f"Within tolerance {IntegratedGradientsAttribution.BATCHED_RELATIVE_TOLERANCE}: "
+          f"{len(items) - failures}/{len(items)} items")
+    assert failures == 0, f"{failures} items exceed the batched IG tolerance"
+
+
+if __name__ == '__main__':
+    main()
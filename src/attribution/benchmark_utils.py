@@ -0,0 +1,162 @@
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from transformers import AutoTokenizer
+
+from model.model import LLM_MODELS
+from modules.utils import get_prompt_template, fill_prompt_template
+from attribution.utils import (
+    encode_with_offsets,
+    find_field_token_span,
+    aggregate_attributions_word
+)
+
+FIELD_MAP = {
+    "esnli": ["premise", "hypothesis"],
+    "comve": ["sentence0", "sentence1"],
+    "ecqa": ["question"]
+}
+
+
+def find_field_token_span_scan(input_text: str, field_text: str, model) -> Tuple[int, int]:
+    # Previous implementation: re-tokenize and scan the token lists.
+    input_ids = model.tokenizer.encode(input_text, add_special_tokens=False)
+    field_ids = model.tokenizer.encode(" " + field_text + "\n", add_special_tokens=False)
+
+    start = None
+    end = None
+
+    for i in range(len(input_ids) - len(field_ids) + 1):
+        if input_ids[i: i + len(field_ids)] == field_ids:
+            start = i
+            end = start + len(field_ids) - 1
+
+    if start is None or end is None:
+        return -1, -1
+
+    return start, end
+
+
+def aggregate_attributions_word_loop(
+        aggregated_token_res: List[Tuple[int, str, float]],
+        method: str = "mean",
+) -> Dict[str, List]:
+    # Previous implementation: walk the tokens one at a time.
+    punctuations = {",", ".", "?", "!"}
+
+    words = []
+    scores = []
+
+    current_word = ""
+    current_score = 0.0
+    count = 0
+
+    for token_id, token, score in aggregated_token_res:
+        token = token.strip()
+
+        if not token or 'Ċ' in token or '<0x0A>' in token:
+            continue
+
+        if token in punctuations:
+            continue
+
+        if token.startswith("Ġ") or token.startswith("▁"):
+            if current_word:
+                final_score = current_score / count if method == "mean" else current_score
+                words.append(current_word)
+                scores.append(final_score)
+
+            clean_token = token.lstrip("Ġ▁")
+            if clean_token and clean_token not in punctuations:
+                current_word = clean_token
+                current_score = score
+                count = 1
+            else:
+                current_word = ""
+                current_score = 0.0
+                count = 0
+        else:
+            current_word += token
+            current_score += score
+            count += 1
+
+    if current_word:
+        final_score = current_score / count if method == "mean" else current_score
+        words.append(current_word)
+        scores.append(final_score)
+
+    return {
+        "words": words,
+        "scores": scores
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model', type=str, default='llama')
+    parser.add_argument('-d', '--dataset', type=str, default='esnli', choices=['comve', 'ecqa', 'esnli'])
+    parser.add_argument('-n', '--num_items', type=int, default=2000)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(LLM_MODELS.get(args.model, args.model))
+    model = SimpleNamespace(tokenizer=tokenizer)
+    fields = FIELD_MAP[args.dataset]
+
+    with open(f"data/formatted/{args.dataset}/test.json", "r", encoding="utf-8") as f:
+        data = json.load(f)[:args.num_items]
+    template = get_prompt_template("zs", args.dataset, "answer")
+    prompts = [fill_prompt_template("answer", template, item) for item in data]
+
+    # === Field spans ===
+    start = time.perf_counter()
+    scan_spans = [
+        [find_field_token_span_scan(prompt, item[field], model) for field in fields]
+        for prompt, item in zip(prompts, data)
+    ]
+    scan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    offset_spans = []
+    for prompt, item in zip(prompts, data):
+        _, offsets = encode_with_offsets(prompt, model)
+        offset_spans.append([find_field_token_span(prompt, item[field], model, offsets) for field in fields])
+    offset_time = time.perf_counter() - start
+
+    span_matches = sum(a == b for a, b in zip(scan_spans, offset_spans))
+    print(f"Field spans: scan {scan_time:.3f}s, offsets {offset_time:.3f}s "
+          f"({scan_time / offset_time:.1f}x), {span_matches}/{len(data)} items identical")
+
+    # === Word aggregation ===
+    token_results = []
+    for prompt in prompts:
+        ids = tokenizer.encode(prompt, add_special_tokens=False)
+        tokens = tokenizer.convert_ids_to_tokens(ids)
+        token_results.append([(i, t, random.random()) for i, t in zip(ids, tokens)])
+
+    for method in ["mean", "sum"]:
+        start = time.perf_counter()
+        loop_words = [aggregate_attributions_word_loop(res, method) for res in token_results]
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cached_words = [aggregate_attributions_word(res, method) for res in token_results]
+        cached_time = time.perf_counter() - start
+
+        word_matches = sum(
+            a["words"] == b["words"] and all(abs(x - y) < 1e-9 for x, y in zip(a["scores"], b["scores"]))
+            for a, b in zip(loop_words, cached_words)
+        )
+        print(f"Word aggregation ({method}): loop {loop_time:.3f}s, cached {cached_time:.3f}s "
+              f"({loop_time / cached_time:.1f}x), {word_matches}/{len(data)} items identical")
+
+
+if __name__ == '__main__':
+    main()
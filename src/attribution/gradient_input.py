@@ -0,0 +1,128 @@
+import torch
+from typing import Dict, List, Tuple
+
+from model.model import GenerationModel
+
+from attribution.batch_planner import IGBatchPlanner, is_oom_error
+from attribution.utils import (
+    TokenizedItem,
+    tokenize_item,
+    aggregate_attributions_target,
+    aggregate_attributions_word,
+    rank_word_attributions
+)
+
+
+class GradientInputAttribution:
+    requires_raw_model = True
+
+    def __init__(
+            self,
+            model: GenerationModel,
+            dataset: str,
+            target_agg_method: str = "abs_mean",
+            word_agg_method: str = "sum"
+    ):
+        self.model = model
+        self.batch_planner = IGBatchPlanner(model)
+        self.dataset = dataset
+        self.target_agg_method = target_agg_method
+        self.word_agg_method = word_agg_method
+
+        self.field_map = {
+            "esnli": ["premise", "hypothesis"],
+            "comve": ["sentence0", "sentence1"],
+            "ecqa": ["question"]
+        }
+
+    def __call__(
+            self,
+            item: Dict
+    ) -> Dict:
+        item['aiw_gxi_feedback'] = {}
+
+        tokenized = tokenize_item(item, self.model, self.field_map[self.dataset])
+
+        target_attr_res = self._compute_gxi(tokenized)
+        formatted_target_attr_res = [attr_res[:tokenized.input_len] for attr_res in target_attr_res]
+        aggregated_target_attr_res = aggregate_attributions_target(formatted_target_attr_res, self.target_agg_method)
+
+        for field in self.field_map[self.dataset]:
+            field_start, field_end = tokenized.field_spans[field]
+            field_tokens = aggregated_target_attr_res[field_start: field_end + 1]
+            item['aiw_gxi_feedback'][field] = aggregate_attributions_word(field_tokens, self.word_agg_method)
+
+        rank_word_attributions(item['aiw_gxi_feedback'], self.field_map[self.dataset])
+
+        return item
+
+    def _gradient_times_input(
+            self,
+            input_embeds: torch.Tensor,
+            attention_mask: torch.Tensor,
+            logit_positions: torch.Tensor,
+            target_token_ids: torch.Tensor
+    ) -> torch.Tensor:
+        input_embeds = input_embeds.detach().requires_grad_()
+        with torch.enable_grad():
+            logits = self.model.model(inputs_embeds=input_embeds, attention_mask=attention_mask).logits
+            rows = torch.arange(logits.size(0), device=logits.device)
+            target_logits = logits[rows, logit_positions, target_token_ids]
+            # Rows are independent, so one backward pass of the sum gives every row its own gradient.
+            gradients, = torch.autograd.grad(target_logits.sum(), input_embeds)
+        return (gradients * input_embeds).sum(dim=-1).detach()
+
+    def _compute_gxi(
+            self,
+            tokenized: TokenizedItem
+    ) -> List[List[Tuple[int, str, float]]]:
+
+        input_ids = torch.tensor([tokenized.input_ids], device=self.model.device)
+        attention_mask = torch.ones_like(input_ids)
+
+        target_start, target_end = tokenized.target_span
+        target_positions = list(range(target_start, target_end + 1))
+        num_targets = len(target_positions)
+
+        # Same row layout as the batched IG path: one row per target token over the longest prefix.
+        causual_input_ids = input_ids[:, :target_end]
+        input_embeds = self.model.model.get_input_embeddings()(causual_input_ids).detach()
+        logit_positions = torch.tensor([pos - 1 for pos in target_positions], device=input_ids.device)
+        target_token_ids = input_ids[0, target_positions]
+
+        seq_len = causual_input_ids.size(1)
+        token_attributions = []
+        start = 0
+        batch_size = self.batch_planner.plan(seq_len, input_ids.device)
+        while start < num_targets:
+            end = min(start + batch_size, num_targets)
+            try:
+                token_attributions.append(self._gradient_times_input(
+                    input_embeds.expand(end - start, -1, -1),
+                    attention_mask[:, :target_end].expand(end - start, -1),
+                    logit_positions[start:end],
+                    target_token_ids[start:end]
+                ))
+            except (RuntimeError, MemoryError) as e:
+                if not is_oom_error(e) or batch_size == 1:
+                    raise e
+                self.batch_planner.record_oom(seq_len, batch_size)
+                if input_ids.device.type == "cuda":
+                    torch.cuda.empty_cache()
+                batch_size = max(1, min(self.batch_planner.plan(seq_len, input_ids.device), batch_size // 2))
+                continue
+            self.batch_planner.record_success(seq_len, end - start)
+            start = end
+        token_attributions = torch.cat(token_attributions, dim=0).to(torch.float32).cpu().numpy()
+
+        target_attribution_results = []
+        for row, target_token_pos in enumerate(target_positions):
+            scores = token_attributions[row, :target_token_pos]
+            result = []
+            for token_id, token, score in zip(
+                    tokenized.input_ids[:target_token_pos], tokenized.tokens[:target_token_pos], scores
+            ):
+                result.append((token_id, token, score))
+            target_attribution_results.append(result)
+
+        return target_attribution_results
@@ -1,32 +1,49 @@
 import torch
-from collections import defaultdict
 from typing import Dict, List, Tuple
 from captum.attr import IntegratedGradients
 
 from model.model import GenerationModel
 
+from attribution.batch_planner import IGBatchPlanner, is_oom_error
 from attribution.utils import (
-    find_target_token_span,
-    find_field_token_span,
+    TokenizedItem,
+    tokenize_item,
     aggregate_attributions_target,
-    aggregate_attributions_word
+    aggregate_attributions_word,
+    rank_word_attributions
 )
 
-from nltk.corpus import stopwords
-
-STOPWORDS = set(stopwords.words('english'))
-
 
 class IntegratedGradientsAttribution:
+    # Runs forward/backward passes on model.model directly.
+    requires_raw_model = True
+    
+    # Batched and per-token attributions differ only by floating point noise from the different
+    # sequence lengths; in bfloat16 the largest score difference stays below this fraction of the
+    # largest score.
+    BATCHED_RELATIVE_TOLERANCE = 1e-2
+    
+    # Riemann steps for models outside the four families tuned below.
+    DEFAULT_N_STEPS = 500
+    
     def __init__(
             self,
             model: GenerationModel,
             dataset: str,
             model_name: str,
             target_agg_method: str = "abs_mean",
-            word_agg_method: str = "sum"
+            word_agg_method: str = "sum",
+            batch_targets: bool = False,
+            adaptive: bool = False,
+            min_steps: int = 32,
+            delta_threshold: float = 0.05
     ):
         self.model = model
+        self.batch_targets = batch_targets
+        self.adaptive = adaptive
+        self.min_steps = min_steps
+        self.delta_threshold = delta_threshold
+        self.batch_planner = IGBatchPlanner(model)
         self.dataset = dataset
         self.target_agg_method = target_agg_method
         self.word_agg_method = word_agg_method
@@ -40,6 +57,9 @@ class IntegratedGradientsAttribution:
             self.n_steps = 500
         elif self.model_name == "qwen":
             self.n_steps = 1000
+        else:
+            # Hub ids and local paths outside LLM_MODELS.
+            self.n_steps = self.DEFAULT_N_STEPS
             
         self.field_map = {
             "esnli": ["premise", "hypothesis"],
@@ -53,85 +73,158 @@ class IntegratedGradientsAttribution:
     ) -> Dict:
         item['aiw_ig_feedback'] = {}
         
-        input_text = self.model.get_formatted_prompt(item["answer"]["prompt"])
-        generated_text = item["answer"]["outputs"][0]
-        target_text = item["answer"]["final"]
-        input_len = self.model.tokenizer(input_text, return_tensors="pt", add_special_tokens=False)["input_ids"].size(1)
+        tokenized = tokenize_item(item, self.model, self.field_map[self.dataset])
         
-        target_attr_res, delta_res = self._compute_ig(input_text, generated_text, target_text, self.n_steps)
+        compute_ig = self._compute_ig_batched if self.batch_targets else self._compute_ig
+        target_attr_res, delta_res, n_steps_res = compute_ig(tokenized, self.n_steps)
         item['aiw_ig_feedback']['delta_res'] = delta_res
+        item['aiw_ig_feedback']['n_steps_res'] = n_steps_res
         
-        formatted_target_attr_res = [attr_res[:input_len] for attr_res in target_attr_res]
+        formatted_target_attr_res = [attr_res[:tokenized.input_len] for attr_res in target_attr_res]
         aggregated_target_attr_res = aggregate_attributions_target(formatted_target_attr_res, self.target_agg_method)
         
         for field in self.field_map[self.dataset]:
-            filed_start, field_end = find_field_token_span(input_text, item[field], self.model)
+            filed_start, field_end = tokenized.field_spans[field]
             field_tokens = aggregated_target_attr_res[filed_start: field_end + 1]
             item['aiw_ig_feedback'][field] = aggregate_attributions_word(field_tokens, self.word_agg_method)
             
-        all_word_score_pairs = []
-        merged_word_score_pairs = defaultdict(float)
-        
-        for field in self.field_map[self.dataset]:
-            word_score_pair = item['aiw_ig_feedback'][field]
-            for word, score in zip(word_score_pair['words'], word_score_pair['scores']):
-                word = word.lower()
-                all_word_score_pairs.append((word, score))
-                merged_word_score_pairs[word] += score
-                
-        all_sorted_word_score_pairs = sorted(all_word_score_pairs, key=lambda x: x[1], reverse=True)
-        item['aiw_ig_feedback']['all_sorted'] = {
-            "words": [word for word, _ in all_sorted_word_score_pairs],
-            "scores": [score for _, score in all_sorted_word_score_pairs]
-        }
-        
-        merged_sorted_word_score_pairs = sorted(merged_word_score_pairs.items(), key=lambda x: x[1], reverse=True)
-        item['aiw_ig_feedback']['merged_sorted'] = {
-            "words": [word for word, _ in merged_sorted_word_score_pairs],
-            "scores": [score for _, score in merged_sorted_word_score_pairs]
-        }
-        
-        all_filtered_word_score_pairs = []
-        for word, score in all_sorted_word_score_pairs:
-            if word not in STOPWORDS:
-                all_filtered_word_score_pairs.append((word, score))
-                
-        merged_filtered_word_score_pairs = []
-        for word, score in merged_sorted_word_score_pairs:
-            if word not in STOPWORDS:
-                merged_filtered_word_score_pairs.append((word, score))
-                
-        item['aiw_ig_feedback']['all_filtered'] = {
-            "words": [word for word, _ in all_filtered_word_score_pairs],
-            "scores": [score for _, score in all_filtered_word_score_pairs]
-        }
-        
-        item['aiw_ig_feedback']['merged_filtered'] = {
-            "words": [word for word, _ in merged_filtered_word_score_pairs],
-            "scores": [score for _, score in merged_filtered_word_score_pairs]
-        }
+        rank_word_attributions(item['aiw_ig_feedback'], self.field_map[self.dataset])
         
         return item
 
+    def _get_baseline(self, input_ids: torch.Tensor, method: str = "eos") -> torch.Tensor:
+        model = self.model.model
+        tokenizer = self.model.tokenizer
+        if method == "zero":
+            baseline_embeds = torch.zeros_like(model.get_input_embeddings()(input_ids))
+        elif method == "pad":
+            pad_token_id = tokenizer.pad_token_id or tokenizer.eos_token_id
+            baseline_input = torch.full_like(input_ids, pad_token_id)
+            baseline_embeds = model.get_input_embeddings()(baseline_input)
+        elif method == "eos":
+            eos_token_id = tokenizer.eos_token_id
+            baseline_input = torch.full_like(input_ids, eos_token_id)
+            baseline_embeds = model.get_input_embeddings()(baseline_input)
+        elif method == "mean":
+            vocab_embeds = model.get_input_embeddings().weight
+            mean_embed = vocab_embeds.mean(dim=0, keepdim=True)  # (1, embed_dim)
+            baseline_embeds = mean_embed.expand_as(model.get_input_embeddings()(input_ids))
+        else:
+            raise ValueError(f"Unknown baseline method: {method}")
+        return baseline_embeds
+    
+    @staticmethod
+    def _select_rows(additional_forward_args: Tuple, rows: torch.Tensor, num_rows: int) -> Tuple:
+        return tuple(
+            arg[rows] if torch.is_tensor(arg) and arg.dim() > 0 and arg.size(0) == num_rows else arg
+            for arg in additional_forward_args
+        )
+    
+    def _safe_attribute(
+            self,
+            ig: IntegratedGradients,
+            input_embeds: torch.Tensor,
+            baseline: torch.Tensor,
+            additional_forward_args: Tuple,
+            n_steps: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        seq_len = input_embeds.size(1)
+        num_rows = input_embeds.size(0)
+        num_examples = num_rows * n_steps
+        batch_size = self.batch_planner.plan(seq_len, input_embeds.device)
+        # captum needs at least one example per input row in every internal batch.
+        while batch_size >= num_rows:
+            try:
+                attributions, delta = ig.attribute(
+                    inputs=input_embeds,
+                    baselines=baseline,
+                    additional_forward_args=additional_forward_args,
+                    n_steps=n_steps,
+                    return_convergence_delta=True,
+                    internal_batch_size=batch_size
+                )
+                # Sizes capped by the number of examples say nothing about what else would fit.
+                if batch_size <= num_examples:
+                    self.batch_planner.record_success(seq_len, batch_size)
+                return attributions, delta
+            except (RuntimeError, MemoryError) as e:
+                if not is_oom_error(e):
+                    raise e
+                self.batch_planner.record_oom(seq_len, batch_size)
+                if input_embeds.device.type == "cuda":
+                    torch.cuda.empty_cache()
+                batch_size = min(self.batch_planner.plan(seq_len, input_embeds.device), batch_size // 2)
+        if num_rows == 1:
+            raise RuntimeError("Failed to attribute even with internal_batch_size=1.")
+        
+        # Not even one example per target row fits: attribute the rows (targets) one at a time.
+        results = []
+        for row in range(num_rows):
+            rows = torch.tensor([row], device=input_embeds.device)
+            results.append(self._safe_attribute(
+                ig,
+                input_embeds[rows].detach().requires_grad_(),
+                baseline[rows],
+                self._select_rows(additional_forward_args, rows, num_rows),
+                n_steps=n_steps
+            ))
+        return torch.cat([a for a, _ in results]), torch.cat([d for _, d in results])
+
+    def _attribute_adaptive(
+            self,
+            ig: IntegratedGradients,
+            input_embeds: torch.Tensor,
+            baseline: torch.Tensor,
+            additional_forward_args: Tuple,
+            n_steps: int
+    ) -> Tuple[torch.Tensor, torch.Tensor, List[int]]:
+        num_rows = input_embeds.size(0)
+        if not self.adaptive:
+            attributions, delta = self._safe_attribute(
+                ig, input_embeds, baseline, additional_forward_args, n_steps=n_steps
+            )
+            return attributions, delta, [n_steps] * num_rows
+        
+        # Double the number of Riemann steps for the rows whose convergence delta is still above the
+        # threshold, up to the model's fixed step count.
+        attributions = torch.zeros_like(input_embeds)
+        delta = torch.zeros(num_rows, device=input_embeds.device)
+        steps_used = [0] * num_rows
+        active = list(range(num_rows))
+        current_steps = min(self.min_steps, n_steps)
+        while active:
+            rows = torch.tensor(active, device=input_embeds.device)
+            active_args = self._select_rows(additional_forward_args, rows, num_rows)
+            active_attributions, active_delta = self._safe_attribute(
+                ig,
+                input_embeds[rows].detach().requires_grad_(),
+                baseline[rows],
+                active_args,
+                n_steps=current_steps
+            )
+            
+            still_active = []
+            for j, row in enumerate(active):
+                attributions[row] = active_attributions[j].detach()
+                delta[row] = active_delta[j].detach()
+                steps_used[row] = current_steps
+                if abs(active_delta[j].item()) >= self.delta_threshold and current_steps < n_steps:
+                    still_active.append(row)
+            active = still_active
+            current_steps = min(current_steps * 2, n_steps)
+            
+        return attributions, delta, steps_used
+    
     def _compute_ig(
             self,
-            input_text: str,
-            generated_text: str,
-            target_text: str,
+            tokenized: TokenizedItem,
             n_steps: int
     ) -> Tuple[List[List[Tuple[int, str, float]]], List[float]]:
         
-        full_text = input_text + generated_text
-        inputs = self.model.tokenizer(full_text, return_tensors="pt", add_special_tokens=False).to(self.model.device)
-        input_ids = inputs["input_ids"]
-        attention_mask = inputs["attention_mask"]
+        input_ids = torch.tensor([tokenized.input_ids], device=self.model.device)
+        attention_mask = torch.ones_like(input_ids)
         
-        target_start, target_end = find_target_token_span(
-            input_text,
-            generated_text,
-            target_text,
-            self.model
-        )
+        target_start, target_end = tokenized.target_span
         
         def forward_func(input_embeds, attention_mask, target_token_id):
             outputs = self.model.model(inputs_embeds=input_embeds, attention_mask=attention_mask)
@@ -139,50 +232,11 @@ class IntegratedGradientsAttribution:
             next_token_logits = logits[:, -1, :]
             return next_token_logits[:, target_token_id]
         
-        def get_baseline(input_ids, model=self.model.model, tokenizer=self.model.tokenizer, method="eos"):
-            if method == "zero":
-                baseline_embeds = torch.zeros_like(model.get_input_embeddings()(input_ids))
-            elif method == "pad":
-                pad_token_id = tokenizer.pad_token_id or tokenizer.eos_token_id
-                baseline_input = torch.full_like(input_ids, pad_token_id)
-                baseline_embeds = model.get_input_embeddings()(baseline_input)
-            elif method == "eos":
-                eos_token_id = tokenizer.eos_token_id
-                baseline_input = torch.full_like(input_ids, eos_token_id)
-                baseline_embeds = model.get_input_embeddings()(baseline_input)
-            elif method == "mean":
-                vocab_embeds = model.get_input_embeddings().weight
-                mean_embed = vocab_embeds.mean(dim=0, keepdim=True)  # (1, embed_dim)
-                baseline_embeds = mean_embed.expand_as(model.get_input_embeddings()(input_ids))
-            else:
-                raise ValueError(f"Unknown baseline method: {method}")
-            return baseline_embeds
-        
-        def safe_attribute(ig, input_embeds, baseline, attention_mask, target_token_id, n_steps, initial_batch_size):
-            batch_size = initial_batch_size
-            while batch_size >= 1:
-                try:
-                    attributions, delta = ig.attribute(
-                        inputs=input_embeds,
-                        baselines=baseline,
-                        additional_forward_args=(attention_mask, target_token_id),
-                        n_steps=n_steps,
-                        return_convergence_delta=True,
-                        internal_batch_size=batch_size
-                    )
-                    return attributions, delta
-                except RuntimeError as e:
-                    if 'CUDA out of memory' in str(e):
-                        batch_size //= 2
-                        torch.cuda.empty_cache()
-                    else:
-                        raise e
-            raise RuntimeError("Failed to attribute even with internal_batch_size=1.")
-        
         ig = IntegratedGradients(forward_func)
         
         target_attribution_results = []
         delta_results = []
+        n_steps_results = []
         for target_token_pos in range(target_start, target_end + 1):
             target_token_id = input_ids[0][target_token_pos].item()
             # target_token_str = self.model.tokenizer.decode(target_token_id)
@@ -193,23 +247,21 @@ class IntegratedGradientsAttribution:
             
             causual_input_embeds = self.model.model.get_input_embeddings()(causual_input_ids).detach().requires_grad_()
             
-            baseline = get_baseline(causual_input_ids, method="eos")
+            baseline = self._get_baseline(causual_input_ids, method="eos")
             
-            attributions, delta = safe_attribute(
+            attributions, delta, steps_used = self._attribute_adaptive(
                 ig,
                 causual_input_embeds,
                 baseline,
-                causual_attention_mask,
-                target_token_id,
-                n_steps=n_steps,
-                initial_batch_size=50
+                (causual_attention_mask, target_token_id),
+                n_steps=n_steps
             )
             
             token_attributions = attributions.sum(dim=-1).squeeze(0)
             scores = token_attributions.detach().cpu().numpy()
             
-            tokens = self.model.tokenizer.convert_ids_to_tokens(input_ids.squeeze(0)[:target_token_pos])
-            token_ids = self.model.tokenizer.convert_tokens_to_ids(tokens)
+            tokens = tokenized.tokens[:target_token_pos]
+            token_ids = tokenized.input_ids[:target_token_pos]
             
             result = []
             for token_id, token, score in zip(token_ids, tokens, scores):
@@ -217,5 +269,97 @@ class IntegratedGradientsAttribution:
                 
             target_attribution_results.append(result)
             delta_results.append(delta.item())
+            n_steps_results.extend(steps_used)
+            
+        return target_attribution_results, delta_results, n_steps_results
+    
+    def _compute_ig_batched(
+            self,
+            tokenized: TokenizedItem,
+            n_steps: int
+    ) -> Tuple[List[List[Tuple[int, str, float]]], List[float]]:
+        
+        input_ids = torch.tensor([tokenized.input_ids], device=self.model.device)
+        attention_mask = torch.ones_like(input_ids)
+        
+        target_start, target_end = tokenized.target_span
+        target_positions = list(range(target_start, target_end + 1))
+        num_targets = len(target_positions)
+        
+        # One row per target token over the longest prefix. The model is causal, so the logit at
+        # position p - 1 of a row only depends on the first p tokens, exactly as in the per-token
+        # path; the tokens after it get zero gradient and are cut off below.
+        causual_input_ids = input_ids[:, :target_end]
+        causual_attention_mask = attention_mask[:, :target_end].expand(num_targets, -1)
+        
+        input_embeds = self.model.model.get_input_embeddings()(causual_input_ids).detach()
+        input_embeds = input_embeds.expand(num_targets, -1, -1).clone().requires_grad_()
+        baseline = self._get_baseline(causual_input_ids, method="eos").expand(num_targets, -1, -1)
+        
+        logit_positions = torch.tensor([pos - 1 for pos in target_positions], device=input_ids.device)
+        target_token_ids = input_ids[0, target_positions]
+        
+        def forward_func(input_embeds, attention_mask, logit_positions, target_token_ids):
+            outputs = self.model.model(inputs_embeds=input_embeds, attention_mask=attention_mask)
+            logits = outputs.logits
+            rows = torch.arange(logits.size(0), device=logits.device)
+            return logits[rows, logit_positions, target_token_ids]
+        
+        ig = IntegratedGradients(forward_func)
+        
+        attributions, delta, n_steps_results = self._attribute_adaptive(
+            ig,
+            input_embeds,
+            baseline,
+            (causual_attention_mask, logit_positions, target_token_ids),
+            n_steps=n_steps
+        )
+        
+        token_attributions = attributions.sum(dim=-1).detach().cpu().numpy()
+        tokens = tokenized.tokens[:target_end]
+        token_ids = tokenized.input_ids[:target_end]
+        
+        target_attribution_results = []
+        for row, target_token_pos in enumerate(target_positions):
+            scores = token_attributions[row, :target_token_pos]
+            result = []
+            for token_id, token, score in zip(token_ids[:target_token_pos], tokens[:target_token_pos], scores):
+                result.append((token_id, token, score))
+            target_attribution_results.append(result)
             
-        return target_attribution_results, delta_results
+        delta_results = delta.detach().cpu().tolist()
+        
+        return target_attribution_results, delta_results, n_steps_results
+    
+    def compare_batched(self, item: Dict) -> Dict[str, float]:
+        tokenized = tokenize_item(item, self.model, self.field_map[self.dataset])
+        
+        per_token_res, per_token_delta, _ = self._compute_ig(tokenized, self.n_steps)
+        batched_res, batched_delta, _ = self._compute_ig_batched(tokenized, self.n_steps)
+        
+        max_abs_diff = 0.0
+        max_abs_score = 0.0
+        max_abs_total = 0.0
+        for per_token, batched in zip(per_token_res, batched_res):
+            for (_, _, a), (_, _, b) in zip(per_token, batched):
+                max_abs_diff = max(max_abs_diff, abs(float(a) - float(b)))
+                max_abs_score = max(max_abs_score, abs(float(a)))
+            max_abs_total = max(max_abs_total, abs(sum(float(a) for _, _, a in per_token)))
+        relative_diff = max_abs_diff / max_abs_score if max_abs_score else 0.0
+        
+        # The convergence deltas are compared against the total attribution of a target (about f(x) - f(baseline)).
+        max_delta_diff = max((abs(a - b) for a, b in zip(per_token_delta, batched_delta)), default=0.0)
+        delta_relative_diff = max_delta_diff / max_abs_total if max_abs_total else 0.0
+        
+        return {
+            "num_targets": len(per_token_res),
+            "max_abs_diff": max_abs_diff,
+            "relative_diff": relative_diff,
+            "max_delta_diff": max_delta_diff,
+            "delta_relative_diff": delta_relative_diff,
+            "within_tolerance": (
+                len(per_token_res) == len(batched_res)
+                and relative_diff <= self.BATCHED_RELATIVE_TOLERANCE
+                and delta_relative_diff <= self.BATCHED_RELATIVE_TOLERANCE
+            )
+        }
@@ -0,0 +1,119 @@
+import torch
+from typing import Dict, List, Tuple
+
+from model.model import GenerationModel
+from attribution.utils import (
+    TokenizedItem,
+    tokenize_item,
+    check_runtime_eager,
+    get_attention_weights,
+    aggregate_attributions_target,
+    aggregate_attributions_word,
+    rank_word_attributions
+)
+
+
+class AttentionRolloutAttribution:
+    requires_raw_model = True
+
+    def __init__(
+            self,
+            model: GenerationModel,
+            dataset: str,
+            residual_alpha: float = 0.5,
+            target_agg_method: str = "abs_mean",
+            word_agg_method: str = "sum"
+    ):
+        self.model = model
+        self.dataset = dataset
+        self.residual_alpha = residual_alpha
+        self.target_agg_method = target_agg_method
+        self.word_agg_method = word_agg_method
+
+        self.field_map = {
+            "esnli": ["premise", "hypothesis"],
+            "comve": ["sentence0", "sentence1"],
+            "ecqa": ["question"]
+        }
+
+    def __call__(
+            self,
+            item: Dict
+    ) -> Dict:
+        item['aiw_rollout_feedback'] = {}
+
+        tokenized = tokenize_item(item, self.model, self.field_map[self.dataset])
+
+        target_attr_res = self._compute_rollout(tokenized)
+        formatted_target_attr_res = [attr_res[:tokenized.input_len] for attr_res in target_attr_res]
+        aggregated_target_attr_res = aggregate_attributions_target(formatted_target_attr_res, self.target_agg_method)
+
+        for field in self.field_map[self.dataset]:
+            field_start, field_end = tokenized.field_spans[field]
+            field_tokens = aggregated_target_attr_res[field_start: field_end + 1]
+            item['aiw_rollout_feedback'][field] = aggregate_attributions_word(field_tokens, self.word_agg_method)
+
+        rank_word_attributions(item['aiw_rollout_feedback'], self.field_map[self.dataset])
+
+        return item
+
+    def _compute_rollout(
+            self,
+            tokenized: TokenizedItem
+    ) -> List[List[Tuple[int, str, float]]]:
+
+        input_ids = torch.tensor([tokenized.input_ids], device=self.model.device)
+        attention_mask = torch.ones_like(input_ids)
+        seq_len = input_ids.size(1)
+
+        target_start, target_end = tokenized.target_span
+        target_positions = torch.arange(target_start, target_end + 1, device=input_ids.device)
+
+        attention_modules = [
+            module for name, module in self.model.model.named_modules() if name.endswith("self_attn")
+        ]
+
+        # Attention rollout (Abnar & Zuidema, 2020): mix each layer's head-averaged attention with the
+        # identity for the residual connection, renormalize the rows and multiply the layers together.
+        # The product is updated layer by layer and each layer's [H, S, S] map is dropped once it is folded in;
+        # eager attention still builds that map for the layer being run.
+        identity = torch.eye(seq_len, dtype=torch.float32, device=input_ids.device)
+        rollout = identity.clone()
+
+        def hook(module, args, output):
+            nonlocal rollout
+            attn = get_attention_weights(module, output)[0].to(torch.float32).mean(dim=0).to(rollout.device)
+            attn = self.residual_alpha * attn + (1 - self.residual_alpha) * identity
+            attn = attn / attn.sum(dim=-1, keepdim=True)
+            rollout = attn @ rollout
+            return (output[0], None) + tuple(output[2:])
+
+        # prepend: runs before the output-capturing hooks transformers installs once output_attentions has been used,
+        # so they never see the full map. Eager attention returns the weights without output_attentions=True.
+        handles = [module.register_forward_hook(hook, prepend=True) for module in attention_modules]
+        check_runtime_eager()
+        attn_implementation = self.model.model.config._attn_implementation
+        self.model.model.config._attn_implementation = "eager"
+        try:
+            with torch.no_grad():
+                self.model.model(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    output_attentions=False,
+                    use_cache=False
+                )
+        finally:
+            for handle in handles:
+                handle.remove()
+            self.model.model.config._attn_implementation = attn_implementation
+
+        target_rows = rollout[target_positions].cpu().numpy()
+
+        target_attribution_results = []
+        for row in range(target_rows.shape[0]):
+            result = []
+            for token_id, token, score in zip(tokenized.input_ids, tokenized.tokens, target_rows[row]):
+                result.append((token_id, token, score))
+            target_attribution_results.append(result)
+
+        return target_attribution_results
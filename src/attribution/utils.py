@@ -1,55 +1,153 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from dataclasses import dataclass
+from collections import defaultdict
 from typing import Dict, List, Tuple, Optional
 
 from model.model import GenerationModel
 
+from nltk.corpus import stopwords
+
+STOPWORDS = set(stopwords.words('english'))
+
+# From this version on, attention layers pick their implementation from config._attn_implementation at every
+# forward, so attribution can switch to eager attention (which returns the weights) for one call.
+RUNTIME_EAGER_MIN_VERSION = "4.48.0"
+
+
+def check_runtime_eager():
+    import transformers
+    from packaging import version
+    if version.parse(transformers.__version__) < version.parse(RUNTIME_EAGER_MIN_VERSION):
+        raise RuntimeError(
+            f"Hook-based attention attribution needs transformers>={RUNTIME_EAGER_MIN_VERSION} "
+            f"(found {transformers.__version__}); older versions fix the attention implementation at load time"
+        )
+
+
+def get_attention_weights(module, output):
+    # Weights of an attention module's forward output; None means the layer did not run eager attention.
+    if len(output) < 2 or output[1] is None:
+        raise RuntimeError(
+            f"{type(module).__name__} returned no attention weights; the eager attention switch did not take "
+            f"effect for this model"
+        )
+    return output[1]
+
+
+def encode_with_offsets(
+        text: str,
+        model: GenerationModel
+) -> Tuple[List[int], List[Tuple[int, int]]]:
+    encoding = model.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    return encoding["input_ids"], encoding["offset_mapping"]
+
+
+def char_span_to_token_span(
+        offsets: List[Tuple[int, int]],
+        char_start: int,
+        char_end: int
+) -> Optional[Tuple[int, int]]:
+    # The span must start and end on token boundaries, i.e. no token may straddle either edge.
+    # Leading spaces folded into the first token's offsets (or left out of them) are both accepted.
+    offsets_array = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+    starts, ends = offsets_array[:, 0], offsets_array[:, 1]
+    
+    first = int(np.searchsorted(ends, char_start, side="right"))
+    last = int(np.searchsorted(starts, char_end, side="left")) - 1
+    if first >= len(offsets) or last < first:
+        return None
+    if starts[first] < char_start or ends[last] > char_end:
+        return None
+    return first, last
+
 
 def find_target_token_span(
         input_text: str,
         generated_text: str,
         target_text: str,
-        model: GenerationModel
+        model: GenerationModel,
+        offsets: Optional[List[Tuple[int, int]]] = None
 ) -> Tuple[int, int]:
-    input_ids = model.tokenizer.encode(input_text, add_special_tokens=False)
-    generated_ids = model.tokenizer.encode(generated_text, add_special_tokens=False)
-    target_ids_no_space = model.tokenizer.encode(target_text, add_special_tokens=False)
-    target_ids_with_space = model.tokenizer.encode(" " + target_text, add_special_tokens=False)
-    
-    start = None
-    end = None
-    
-    for candidates_ids in [target_ids_with_space, target_ids_no_space]:
-        for i in range(len(generated_ids) - len(candidates_ids) + 1):
-            if generated_ids[i: i + len(candidates_ids)] == candidates_ids:
-                start = len(input_ids) + i
-                end = start + len(candidates_ids) - 1
-                return start, end
+    # Token positions refer to the tokenization of input_text + generated_text.
+    if offsets is None:
+        _, offsets = encode_with_offsets(input_text + generated_text, model)
+    
+    for candidate in [" " + target_text, target_text]:
+        char_start = generated_text.find(candidate)
+        while char_start >= 0:
+            span = char_span_to_token_span(
+                offsets,
+                len(input_text) + char_start,
+                len(input_text) + char_start + len(candidate)
+            )
+            if span is not None:
+                return span
+            char_start = generated_text.find(candidate, char_start + 1)
             
-    if start is None or end is None:
-        return -1, -1
+    return -1, -1
 
 
 def find_field_token_span(
         input_text: str,
         field_text: str,
-        model: GenerationModel
+        model: GenerationModel,
+        offsets: Optional[List[Tuple[int, int]]] = None
 ) -> Tuple[int, int]:
-    input_ids = model.tokenizer.encode(input_text, add_special_tokens=False)
-    field_ids = model.tokenizer.encode(" " + field_text + "\n", add_special_tokens=False)
+    if offsets is None:
+        _, offsets = encode_with_offsets(input_text, model)
     
-    start = None
-    end = None
+    # The last occurrence wins, as the field is filled into the prompt after any instructions.
+    candidate = " " + field_text + "\n"
+    char_start = input_text.rfind(candidate)
+    while char_start >= 0:
+        span = char_span_to_token_span(offsets, char_start, char_start + len(candidate))
+        if span is not None:
+            return span
+        char_start = input_text.rfind(candidate, 0, char_start)
+        
+    return -1, -1
+
+
+@dataclass
+class TokenizedItem:
+    # One tokenization of input_text + generated_text (no special tokens added; the chat template
+    # already carries them), shared by the attribution backends and the span helpers.
+    input_text: str
+    generated_text: str
+    input_ids: List[int]
+    offsets: List[Tuple[int, int]]
+    tokens: List[str]
+    input_len: int
+    target_span: Tuple[int, int]
+    field_spans: Dict[str, Tuple[int, int]]
+
+
+def tokenize_item(
+        item: Dict,
+        model: GenerationModel,
+        fields: List[str]
+) -> TokenizedItem:
+    input_text = model.get_formatted_prompt(item["answer"]["prompt"])
+    generated_text = item["answer"]["outputs"][0]
+    target_text = item["answer"]["final"]
     
-    for i in range(len(input_ids) - len(field_ids) + 1):
-        if input_ids[i: i + len(field_ids)] == field_ids:
-            start = i
-            end = start + len(field_ids) - 1
-            
-    if start is None or end is None:
-        return -1, -1
+    input_ids, offsets = encode_with_offsets(input_text + generated_text, model)
+    ends = np.asarray(offsets, dtype=np.int64).reshape(-1, 2)[:, 1]
+    input_len = int(np.searchsorted(ends, len(input_text), side="right"))
     
-    return start, end
+    return TokenizedItem(
+        input_text=input_text,
+        generated_text=generated_text,
+        input_ids=input_ids,
+        offsets=offsets,
+        tokens=model.tokenizer.convert_ids_to_tokens(input_ids),
+        input_len=input_len,
+        target_span=find_target_token_span(input_text, generated_text, target_text, model, offsets),
+        field_spans={
+            field: find_field_token_span(input_text, item[field], model, offsets) for field in fields
+        }
+    )
 
 
 def aggregate_attributions_target(
@@ -81,60 +179,114 @@ def aggregate_attributions_target(
     return list(zip(token_ids, tokens, aggregated.tolist()))
 
 
+PUNCTUATIONS = {",", ".", "?", "!"}
+
+# Token string -> None (skipped), or (opens_word, cleaned piece). Vocabularies are small,
+# so classifying each distinct token once replaces the per-occurrence string handling.
+_WORD_PIECES: Dict[str, Optional[Tuple[bool, str]]] = {}
+
+
+def _classify_token(token: str) -> Optional[Tuple[bool, str]]:
+    stripped = token.strip()
+    if not stripped or 'Ċ' in stripped or '<0x0A>' in stripped or stripped in PUNCTUATIONS:
+        info = None
+    elif stripped.startswith("Ġ") or stripped.startswith("▁"):
+        # An empty or punctuation-only word start closes the previous word without opening a new one.
+        piece = stripped.lstrip("Ġ▁")
+        info = (True, piece if piece not in PUNCTUATIONS else "")
+    else:
+        info = (False, stripped)
+    _WORD_PIECES[token] = info
+    return info
+
+
 def aggregate_attributions_word(
         aggregated_token_res: List[Tuple[int, str, float]],
         method: str = "mean",
 ) -> Dict[str, List]:
 
-    punctuations = {",", ".", "?", "!"}
-    
     words = []
-    scores = []
-    
-    current_word = ""
-    current_score = 0.0
-    count = 0
+    sums = []
+    counts = []
+    in_word = False
     
     for token_id, token, score in aggregated_token_res:
-        token = token.strip()
-        
-        if not token or 'Ċ' in token or '<0x0A>' in token:
-            continue
-        
-        if token in punctuations:
+        info = _WORD_PIECES[token] if token in _WORD_PIECES else _classify_token(token)
+        if info is None:
             continue
         
-        if token.startswith("Ġ") or token.startswith("▁"):
-            if current_word:
-                final_score = current_score / count if method == "mean" else current_score
-                words.append(current_word)
-                scores.append(final_score)
-                
-            clean_token = token.lstrip("Ġ▁")
-            if clean_token and clean_token not in punctuations:
-                current_word = clean_token
-                current_score = score
-                count = 1
-            else:
-                current_word = ""
-                current_score = 0.0
-                count = 0
+        opens_word, piece = info
+        if opens_word and not piece:
+            in_word = False
+        elif opens_word or not in_word:
+            words.append(piece)
+            sums.append(score)
+            counts.append(1)
+            in_word = True
         else:
-            current_word += token
-            current_score += score
-            count += 1
+            words[-1] += piece
+            sums[-1] += score
+            counts[-1] += 1
             
-    if current_word:
-        final_score = current_score / count if method == "mean" else current_score
-        words.append(current_word)
-        scores.append(final_score)
+    if method == "mean":
+        sums = [total / count for total, count in zip(sums, counts)]
         
     return {
         "words": words,
-        "scores": scores
+        "scores": sums
     }
 
 
+def rank_word_attributions(
+        feedback: Dict,
+        fields: List[str]
+) -> Dict:
+    # Fills the rankings the refinement prompts read from the per-field word scores in feedback.
+    all_word_score_pairs = []
+    merged_word_score_pairs = defaultdict(float)
+    
+    for field in fields:
+        word_score_pair = feedback[field]
+        for word, score in zip(word_score_pair['words'], word_score_pair['scores']):
+            word = word.lower()
+            all_word_score_pairs.append((word, score))
+            merged_word_score_pairs[word] += score
+            
+    all_sorted_word_score_pairs = sorted(all_word_score_pairs, key=lambda x: x[1], reverse=True)
+    feedback['all_sorted'] = {
+        "words": [word for word, _ in all_sorted_word_score_pairs],
+        "scores": [score for _, score in all_sorted_word_score_pairs]
+    }
+    
+    merged_sorted_word_score_pairs = sorted(merged_word_score_pairs.items(), key=lambda x: x[1], reverse=True)
+    feedback['merged_sorted'] = {
+        "words": [word for word, _ in merged_sorted_word_score_pairs],
+        "scores": [score for _, score in merged_sorted_word_score_pairs]
+    }
+    
+    all_filtered_word_score_pairs = []
+    for word, score in all_sorted_word_score_pairs:
+        if word not in STOPWORDS:
+            all_filtered_word_score_pairs.append((word, score))
+            
+    merged_filtered_word_score_pairs = []
+    for word, score in merged_sorted_word_score_pairs:
+        if word not in STOPWORDS:
+            merged_filtered_word_score_pairs.append((word, score))
+            
+    feedback['all_filtered'] = {
+        "words": [word for word, _ in all_filtered_word_score_pairs],
+        "scores": [score for _, score in all_filtered_word_score_pairs]
+    }
+    
+    feedback['merged_filtered'] = {
+        "words": [word for word, _ in merged_filtered_word_score_pairs],
+        "scores": [score for _, score in merged_filtered_word_score_pairs]
+    }
+    
+    return feedback
+
+
 def plot_word_attributions(
         word_attributions: List[Tuple[str, float]],
         title: str,
@@ -0,0 +1,140 @@
+import os
+import json
+import mmap
+import numpy as np
+from typing import Dict, List, Optional, Tuple, Union
+
+from evaluation.stream import iter_json_array_spans
+
+
+class EditDataset:
+    # Lazy view of the edit records in ext_final.json (the "extract_edits_dataset" list). The file is memory-mapped
+    # and records are only parsed up to the furthest one requested; their byte offsets are kept in a
+    # "<name>.index.npz" sidecar, so later runs jump straight to a record without parsing anything before it.
+    # key=None reads a file whose top level is the list itself.
+    def __init__(self, path: str, key: Optional[str] = "extract_edits_dataset", chunk_size: int = 1 << 20):
+        self.path = path
+        self.key = key
+        self.chunk_size = chunk_size
+        self.index_path = os.path.splitext(path)[0] + ".index.npz"
+
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        stat = os.stat(path)
+        self.signature = [stat.st_size, stat.st_mtime_ns]
+
+        self.spans: List[Tuple[int, int]] = []
+        self.keys: List[Tuple[int, int]] = []
+        self.complete = False
+        self.array_start = None
+        self.positions: Optional[Dict[Tuple[int, int], int]] = None
+        self.load_index()
+        if self.array_start is None:
+            self.array_start = self.find_array()
+
+    # === Index ===
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with np.load(self.index_path) as index:
+            if index["signature"].tolist() != self.signature or str(index["key"]) != str(self.key):
+                return
+            self.array_start = int(index["array_start"])
+            self.complete = bool(index["complete"])
+            self.spans = [tuple(span) for span in index["spans"].tolist()]
+            self.keys = [tuple(key) for key in index["keys"].tolist()]
+
+    def save_index(self):
+        tmp_path = self.index_path[:-len(".npz")] + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            signature=np.array(self.signature, dtype=np.int64),
+            key=np.array(str(self.key)),
+            array_start=np.int64(self.array_start),
+            complete=np.bool_(self.complete),
+            spans=np.array(self.spans, dtype=np.int64).reshape(-1, 2),
+            keys=np.array(self.keys, dtype=np.int64).reshape(-1, 2)
+        )
+        os.replace(tmp_path, self.index_path)
+
+    def find_array(self) -> int:
+        # Byte offset just past the "[" of the list, found without parsing anything else.
+        mm = self.mm
+        if self.key is None:
+            pos = mm.find(b"[")
+            if pos == -1:
+                raise ValueError(f"{self.path} does not contain a JSON array")
+            return pos + 1
+
+        needle = json.dumps(self.key).encode("utf-8")
+        pos = mm.find(needle)
+        while pos != -1:
+            after = pos + len(needle)
+            while mm[after:after + 1] in (b" ", b"\t", b"\n", b"\r"):
+                after += 1
+            # Occurrences inside string values have an escaped quote and no colon after them.
+            if mm[after:after + 1] == b":" and (pos == 0 or mm[pos - 1:pos] != b"\\"):
+                after += 1
+                while mm[after:after + 1] in (b" ", b"\t", b"\n", b"\r"):
+                    after += 1
+                if mm[after:after + 1] != b"[":
+                    raise ValueError(f"{self.key} in {self.path} is not a list")
+                return after + 1
+            pos = mm.find(needle, pos + 1)
+        raise KeyError(f"{self.key} not found in {self.path}")
+
+    def scan(self, stop: Optional[int] = None):
+        # Extends the index record by record until `stop` records are known or the list ends.
+        if self.complete or (stop is not None and len(self.spans) >= stop):
+            return
+        num_known = len(self.spans)
+        pos = self.spans[-1][1] if self.spans else self.array_start
+        for item, start, end in iter_json_array_spans(self.mm, pos, self.chunk_size):
+            self.spans.append((start, end))
+            self.keys.append((item["idx"], item.get("eidx", -1)))
+            if stop is not None and len(self.spans) >= stop:
+                break
+        else:
+            self.complete = True
+        if len(self.spans) > num_known or self.complete:
+            self.positions = None
+            self.save_index()
+
+    # === Access ===
+    def read(self, i: int) -> Dict:
+        start, end = self.spans[i]
+        return json.loads(self.mm[start:end])
+
+    def head(self, n: int) -> List[Dict]:
+        self.scan(n)
+        return [self.read(i) for i in range(min(n, len(self.spans)))]
+
+    def __len__(self) -> int:
+        self.scan()
+        return len(self.spans)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Dict, List[Dict]]:
+        if isinstance(i, slice):
+            # Only slices with a non-negative stop can be served without indexing the whole list.
+            if i.stop is not None and i.stop >= 0 and (i.start is None or i.start >= 0):
+                self.scan(i.stop)
+            else:
+                self.scan()
+            return [self.read(j) for j in range(len(self.spans))[i]]
+        if i < 0:
+            self.scan()
+            i += len(self.spans)
+        else:
+            self.scan(i + 1)
+        if not 0 <= i < len(self.spans):
+            raise IndexError(i)
+        return self.read(i)
+
+    def get(self, idx: int, eidx: int) -> Dict:
+        if self.positions is None:
+            self.scan()
+            self.positions = {key: i for i, key in enumerate(self.keys)}
+        return self.read(self.positions[(idx, eidx)])
+
+    def close(self):
+        self.mm.close()
@@ -1,10 +1,26 @@
 import os
 import json
+import time
+import random
+import asyncio
 import argparse
 from tqdm import tqdm
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+client = None
+
+EDIT_FIELDS = {
+    "esnli": ["premise", "hypothesis"],
+    "comve": ["sentence0", "sentence1"],
+    "ecqa": ["question"]
+}
+
+EDIT_PROMPTS = {
+    "esnli": "edit_prompt_10.txt",
+    "comve": "edit_prompt_10.txt",
+    "ecqa": "edit_prompt_20.txt"
+}
 
-client = OpenAI()
 
 def generate(prompt, model_version="gpt-4o-2024-08-06"):
     completion = client.chat.completions.create(
@@ -84,12 +100,147 @@ def generate_edits(dataset, dataset_name):
     return edits_dataset
 
 
+def get_retry_after(e: Exception):
+    # Seconds the server asked us to wait (Retry-After / retry-after-ms headers), if any.
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    retry_after_ms = response.headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = response.headers.get("retry-after")
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return None
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code >= 500
+
+
+async def agenerate(async_client, semaphore, prompt, model_version, max_retries=8, base_delay=1.0, max_delay=60.0):
+    for attempt in range(max_retries + 1):
+        try:
+            # The semaphore only bounds requests in flight; backoff sleeps happen outside it.
+            async with semaphore:
+                completion = await async_client.chat.completions.create(
+                    model=model_version,
+                    messages=[
+                        {"role": "system", "content": "You are a helpful assistant!"},
+                        {"role": "user", "content": prompt}
+                    ]
+                )
+            return completion.choices[0].message.content
+        except Exception as e:
+            if not is_retryable(e) or attempt == max_retries:
+                raise
+            delay = get_retry_after(e)
+            if delay is None:
+                delay = min(max_delay, base_delay * 2 ** attempt) * (0.5 + random.random() / 2)
+            await asyncio.sleep(delay)
+
+
+async def gather_or_cancel(*aws):
+    # Like asyncio.gather, but once one of them fails the others are cancelled and awaited, so none is still
+    # using the client or the checkpoint file when the caller cleans up.
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def agenerate_edits(dataset, dataset_name, output_path, args):
+    fields = EDIT_FIELDS[dataset_name]
+    with open(os.path.join(os.path.dirname(__file__), EDIT_PROMPTS[dataset_name]), 'r') as f:
+        prompt_prefix = f.read()
+
+    # Finished items are appended to a checkpoint next to the output, so an interrupted run resumes
+    # where it stopped; the final file keeps the input order.
+    checkpoint_path = os.path.splitext(output_path)[0] + ".partial.jsonl"
+    done = {}
+    if os.path.exists(checkpoint_path):
+        valid_end = 0
+        with open(checkpoint_path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                done[record['i']] = record['edits']
+                valid_end += len(line)
+        # Drop a partially written last line so that new records append cleanly.
+        with open(checkpoint_path, 'r+b') as f:
+            f.truncate(valid_end)
+        print(f"Resuming from {checkpoint_path}: {len(done)} items already done")
+
+    async_client = AsyncOpenAI(
+        base_url=args.base_url,
+        api_key=os.environ.get("OPENAI_API_KEY", "EMPTY" if args.base_url else None),
+        max_retries=0
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+    pbar = tqdm(total=len(dataset), initial=len(done), desc="Processing")
+
+    with open(checkpoint_path, 'a') as checkpoint:
+        last_flush = time.monotonic()
+
+        async def process(i, data):
+            nonlocal last_flush
+            if i in done:
+                return done[i]
+            outputs = await gather_or_cancel(*[
+                agenerate(async_client, semaphore, prompt_prefix + data[field] + "\nOutput:\n", args.model_version,
+                          max_retries=args.max_retries)
+                for field in fields
+            ])
+            edits = {f'edit_gen_{field}': output for field, output in zip(fields, outputs)}
+            checkpoint.write(json.dumps({'i': i, 'edits': edits}) + "\n")
+            if time.monotonic() - last_flush >= args.checkpoint_interval:
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+                last_flush = time.monotonic()
+            pbar.update(1)
+            return edits
+
+        try:
+            # Results come back in the order of the inputs, whatever order they finish in.
+            results = await gather_or_cancel(*[process(i, data) for i, data in enumerate(dataset)])
+        finally:
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+            pbar.close()
+            await async_client.close()
+
+    edits_dataset = []
+    for data, edits in zip(dataset, results):
+        data.update(edits)
+        edits_dataset.append(data)
+    return edits_dataset, checkpoint_path
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-dir', "--dir", type=str, default='data')
     parser.add_argument('-d', '--dataset', type=str, default='esnli', choices=['comve', 'ecqa', 'esnli'])
     parser.add_argument('-dt','--dataset_type', type=str, default='org', choices=['org', 'failed'])
     parser.add_argument('-n', '--num_data', type=int, default=3)
+    parser.add_argument('-m', '--mode', type=str, default='sync', choices=['sync', 'async'])
+    parser.add_argument('--model_version', type=str, default='gpt-4o-2024-08-06', help="model name (async mode)")
+    parser.add_argument('--base_url', type=str, default=None, help="OpenAI-compatible endpoint, e.g. a local mock server")
+    parser.add_argument('--concurrency', type=int, default=16, help="maximum requests in flight (async mode)")
+    parser.add_argument('--max_retries', type=int, default=8)
+    parser.add_argument('--checkpoint_interval', type=float, default=5.0, help="seconds between checkpoint fsyncs")
     args = parser.parse_args()
 
     dir = args.dir
@@ -106,8 +257,6 @@ def main():
         with open(dataset_path, 'r') as f:
             dataset = json.load(f)['extract_edits_failed']
 
-    edits_dataset = generate_edits(dataset, dataset_name)
-
     if dataset_type == 'org':
         edits_output_path = os.path.join(dir, 'counterfactual', dataset_name, "gen_org.json")
     elif dataset_type == 'failed':
@@ -116,7 +265,19 @@ def main():
     output_dir = os.path.dirname(edits_output_path)
     os.makedirs(output_dir, exist_ok=True)
 
+    checkpoint_path = None
+    if args.mode == 'async':
+        edits_dataset, checkpoint_path = asyncio.run(agenerate_edits(dataset, dataset_name, edits_output_path, args))
+    else:
+        global client
+        client = OpenAI(base_url=args.base_url)
+        edits_dataset = generate_edits(dataset, dataset_name)
+
     with open(edits_output_path, 'w') as f:
         json.dump(edits_dataset, f, indent=4)
-    
-main()
+    if checkpoint_path is not None:
+        os.remove(checkpoint_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,76 @@
 import os
-import json
 from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from tabulate import tabulate
 from utils import setup_loggers
+from stream import iter_items, JsonArrayWriter
+
+
+def build_answer_index(org_path):
+    # Only idx -> final answer is kept for the original run, not the items themselves.
+    return {org_item['idx']: org_item["answer"]["final"] for org_item in iter_items(org_path, ["answer.final"])}
 
 
 def counter_stats(org_path, ct_path, save_path):
-    with open(org_path, 'r', encoding='utf-8') as f:
-        org_data = json.load(f)
-    with open(ct_path, 'r', encoding='utf-8') as f:
-        ct_data = json.load(f)
-        
+    org_answers = build_answer_index(org_path)
+    
     total = 0
     valid = 0
+    missing = 0
     counter = 0
-    counter_data = []
+    # [valid, counter] per edit position and per edit index
+    by_pos = defaultdict(lambda: [0, 0])
+    by_eidx = defaultdict(lambda: [0, 0])
     
-    for ct_item in ct_data:
-        total += 1
-        
-        idx = ct_item['idx']
-        eidx = ct_item['eidx']
-        
-        org_pred = org_data[idx]["answer"]["final"]
-        ct_pred = ct_item["answer"]["final"]
-        
-        if org_pred is None or ct_pred is None:
-            continue
-        
-        valid += 1
-        
-        if org_pred != ct_pred:
-            counter += 1
-            counter_data.append(ct_item)
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    with JsonArrayWriter(save_path) as writer:
+        for ct_item in iter_items(ct_path):
+            total += 1
+            
+            idx = ct_item['idx']
+            eidx = ct_item['eidx']
+            
+            if idx not in org_answers:
+                missing += 1
+                continue
+                
+            org_pred = org_answers[idx]
+            ct_pred = ct_item["answer"]["final"]
             
+            if org_pred is None or ct_pred is None:
+                continue
+                
+            valid += 1
+            flipped = org_pred != ct_pred
+            for stats in (by_pos[ct_item.get('edit_pos')], by_eidx[eidx]):
+                stats[0] += 1
+                stats[1] += flipped
+                
+            if flipped:
+                counter += 1
+                writer.write(ct_item)
+                
     counter_rate = counter / valid
     
-    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-    with open(save_path, 'w', encoding='utf-8') as f:
-        json.dump(counter_data, f, indent=4, ensure_ascii=False)
-        
-    return total, valid, counter, counter_rate
+    res = {
+        "total": total,
+        "valid": valid,
+        "missing": missing,
+        "counter": counter,
+        "counter_rate": counter_rate,
+        "by_pos": dict(by_pos),
+        "by_eidx": dict(sorted(by_eidx.items())),
+    }
+    return res
+
+
+def compute_stats(task):
+    return counter_stats(*task)
+
+
+def format_rate(counter, valid):
+    return f"{counter / valid * 100:.2f}%" if valid else "-"
 
 
 if __name__ == '__main__':
@@ -54,28 +84,56 @@ if __name__ == '__main__':
     log_path = f"logs/counter_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
     logger, blank_logger = setup_loggers(log_path)
     
+    # === Collect result files ===
+    keys = []
+    tasks = []
     for prompt_type in prompt_types:
         for dataset_name in datasets:
-            table = []
             for model_name in models:
                 for answer_source in answer_sources:
                     org_path = f"{base}/original/{prompt_type}-{dataset_name}-{model_name}/answer_{answer_source}.json"
                     ct_path = f"{base}/counterfactual/{prompt_type}-{dataset_name}-{model_name}/answer_{answer_source}.json"
                     save_path = f"{base}/counterfactual/{prompt_type}-{dataset_name}-{model_name}/answer_{answer_source}_counter.json"
                     
-                    total, valid, counter, counter_rate = counter_stats(org_path, ct_path, save_path)
+                    keys.append((prompt_type, dataset_name, model_name, answer_source))
+                    tasks.append((org_path, ct_path, save_path))
                     
-                    table.append([
-                        prompt_type,
-                        dataset_name,
-                        model_name,
-                        answer_source,
-                        total,
-                        valid,
-                        counter,
-                        f"{counter_rate * 100:.2f}%"
+    # === Stats ===
+    # Every (model, dataset) pair is independent, so they run in parallel; map keeps the task order.
+    with ProcessPoolExecutor() as executor:
+        results = dict(zip(keys, executor.map(compute_stats, tasks)))
+        
+    for prompt_type in prompt_types:
+        for dataset_name in datasets:
+            table = []
+            pos_table = []
+            eidx_table = []
+            for model_name in models:
+                for answer_source in answer_sources:
+                    res = results[(prompt_type, dataset_name, model_name, answer_source)]
+                    row = [prompt_type, dataset_name, model_name, answer_source]
+                    
+                    table.append(row + [
+                        res["total"],
+                        res["valid"],
+                        res["missing"],
+                        res["counter"],
+                        f"{res['counter_rate'] * 100:.2f}%"
                     ])
-            headers = ['Prompt', 'Dataset', 'Model', 'Answer', "Total", "Valid", "Counter", "Counter Rate"]
+                    for edit_pos, (valid, counter) in res["by_pos"].items():
+                        pos_table.append(row + [edit_pos, valid, counter, format_rate(counter, valid)])
+                    for eidx, (valid, counter) in res["by_eidx"].items():
+                        eidx_table.append(row + [eidx, valid, counter, format_rate(counter, valid)])
+                        
+            headers = ['Prompt', 'Dataset', 'Model', 'Answer', "Total", "Valid", "Missing", "Counter", "Counter Rate"]
             blank_logger.info(tabulate(table, headers=headers, tablefmt="pretty"))
             blank_logger.info("")
+            
+            headers = ['Prompt', 'Dataset', 'Model', 'Answer', "Edit Pos", "Valid", "Counter", "Counter Rate"]
+            blank_logger.info(tabulate(pos_table, headers=headers, tablefmt="pretty"))
+            blank_logger.info("")
+            
+            headers = ['Prompt', 'Dataset', 'Model', 'Answer', "Eidx", "Valid", "Counter", "Counter Rate"]
+            blank_logger.info(tabulate(eidx_table, headers=headers, tablefmt="pretty"))
+            blank_logger.info("")
         blank_logger.info("")
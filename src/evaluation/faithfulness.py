@@ -1,113 +1,87 @@
-import json
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from tabulate import tabulate
 from utils import setup_loggers
+from stream import iter_items
+from matcher import WordMatcher
 
 
-def is_word_in_expl(word, expl):
-    return word.lower() in expl.lower()
-
-
-def init_stats(ct_path):
-    with open(ct_path, 'r', encoding='utf-8') as f:
-        ct_data = json.load(f)
-        
+def count_stats(items, get_explanation, match_modes=("substring",), chunk_size=1024):
+    # Counters only: items are streamed from disk and dropped once counted. Valid items are matched
+    # chunk by chunk in every mode of match_modes; faith/unfaith follow the first one, the others are
+    # reported alongside.
+    matcher = WordMatcher(match_modes)
     total = 0
     valid = 0
-    faith = 0
-    unfaith = 0
+    length_sum = 0
+    unfaith_by_mode = {mode: 0 for mode in matcher.modes}
+    words, expls = [], []
     
-    faith_items = []
-    unfaith_items = []
+    def flush():
+        matches = matcher.match_batch(words, expls)
+        for mode, matched in matches.items():
+            unfaith_by_mode[mode] += int((~matched).sum())
+        words.clear()
+        expls.clear()
     
-    lengths = []
-    
-    for ct_item in ct_data:
+    for ct_item in items:
         total += 1
         
-        if ct_item["explanation"] is None or ct_item["explanation"]["final"] is None:
+        gen_expl = get_explanation(ct_item)
+        if gen_expl is None:
             continue
         
         valid += 1
-        
-        edit_word = ct_item["edit_word"]
-        gen_expl = ct_item["explanation"]["final"]
-        
-        lengths.append(len(gen_expl.split()))
-        
-        if is_word_in_expl(edit_word, gen_expl):
-            faith += 1
-            faith_items.append(ct_item)
-        else:
-            unfaith += 1
-            unfaith_items.append(ct_item)
-            
-    faith_rate = faith / valid
-    unfaith_rate = unfaith / valid
+        length_sum += len(gen_expl.split())
+        words.append(ct_item["edit_word"])
+        expls.append(gen_expl)
+        if len(words) >= chunk_size:
+            flush()
+    flush()
     
+    unfaith = unfaith_by_mode[match_modes[0]]
+    faith = valid - unfaith
     res = {
         "total": total,
         "valid": valid,
         "faith": faith,
         "unfaith": unfaith,
-        "faith_rate": faith_rate,
-        "unfaith_rate": unfaith_rate,
-        "lengths": sum(lengths)/ len(lengths),
+        "faith_rate": faith / valid,
+        "unfaith_rate": unfaith / valid,
+        "lengths": length_sum / valid,
+        "unfaith_rate_by_mode": {mode: count / valid for mode, count in unfaith_by_mode.items()},
     }
     return res
 
 
-def refined_stats(ct_path, feedback_type):
-    with open(ct_path, 'r', encoding='utf-8') as f:
-        ct_data = json.load(f)
-        
-    total = 0
-    valid = 0
-    faith = 0
-    unfaith = 0
+def init_stats(ct_path, match_modes=("substring",)):
+    def get_explanation(ct_item):
+        if ct_item["explanation"] is None:
+            return None
+        return ct_item["explanation"]["final"]
     
-    faith_items = []
-    unfaith_items = []
-    
-    lengths = []
-    
-    for ct_item in ct_data:
-        total += 1
-        
+    columns = ["edit_word", "explanation.final"]
+    return count_stats(iter_items(ct_path, columns), get_explanation, match_modes)
+
+
+def refined_stats(ct_path, feedback_type, match_modes=("substring",)):
+    def get_explanation(ct_item):
         if feedback_type == 'iw' and not ct_item[f"{feedback_type}_feedback"]['final'][0]:
-            continue
-        
-        if ct_item[f"{feedback_type}_refinement"] is None or ct_item[f"{feedback_type}_refinement"]['final'] is None:
-            continue
-        
-        valid += 1
-        
-        edit_word = ct_item["edit_word"]
-        gen_expl = ct_item[f"{feedback_type}_refinement"]['final']
-        
-        lengths.append(len(gen_expl.split()))
-        
-        if is_word_in_expl(edit_word, gen_expl):
-            faith += 1
-            faith_items.append(ct_item)
-        else:
-            unfaith += 1
-            unfaith_items.append(ct_item)
-            
-    faith_rate = faith / valid
-    unfaith_rate = unfaith / valid
+            return None
+        if ct_item[f"{feedback_type}_refinement"] is None:
+            return None
+        return ct_item[f"{feedback_type}_refinement"]['final']
     
-    res = {
-        "total": total,
-        "valid": valid,
-        "faith": faith,
-        "unfaith": unfaith,
-        "faith_rate": faith_rate,
-        "unfaith_rate": unfaith_rate,
-        "lengths": sum(lengths)/ len(lengths),
-    }
-    return res
+    columns = ["edit_word", f"{feedback_type}_feedback.final", f"{feedback_type}_refinement.final"]
+    return count_stats(iter_items(ct_path, columns), get_explanation, match_modes)
+
+
+def compute_stats(task):
+    stage, path, feedback_type, match_modes = task
+    if stage == "init":
+        return init_stats(path, match_modes)
+    return refined_stats(path, feedback_type, match_modes)
 
 
 if __name__ == '__main__':
@@ -121,11 +95,16 @@ if __name__ == '__main__':
     feedback_types = ['nl', 'iw', 'aiw_attn', 'aiw_ig']
     explanation_sources = ['gd', 'sc']
     iterations = [0, 1, 2]
+    # The first mode decides faith/unfaith; "substring" reproduces the reported numbers. The other modes are
+    # logged next to it. "lemma" and "stem" are opt-in: they need nltk (and the wordnet corpus for "lemma").
+    match_modes = ["substring", "token"]
     
     log_path = f"logs/faithfulness_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
     logger, blank_logger = setup_loggers(log_path)
     
-    results = []
+    # === Collect result files ===
+    tasks = []
+    rows = []
     for dataset_name in datasets:
         for model_name in models:
             base_dir = f"{base}/{dataset_type}/{prompt_type}-{dataset_name}-{model_name}"
@@ -136,43 +115,47 @@ if __name__ == '__main__':
                 else:
                     path = f"{base_dir}/explanation_{explanation_source}.json"
                     
-                res = init_stats(path)
-                
-                results.append({
+                tasks.append(("init", path, None, match_modes))
+                rows.append({
                     "Dataset": dataset_name,
                     "Model": model_name,
                     "Stage": "init",
                     "Iter": "-",
                     "Type": explanation_source,
-                    "Total": res["total"],
-                    "Valid": res["valid"],
-                    "Faith": res["faith"],
-                    "Unfaith": res["unfaith"],
-                    "Faith Rate": round(res['faith_rate'], 4),
-                    "Unfaith Rate": round(res['unfaith_rate'], 4),
-                    "Lengths": round(res['lengths'], 4),
                 })
                 
             # === Refined explanation ===
             for i in iterations:
                 for feedback_type in feedback_types:
                     path = f"{base_dir}/iter{i}_refinement_{feedback_type}.json"
-                    res = refined_stats(path, feedback_type)
-                    
-                    results.append({
+                    tasks.append(("refined", path, feedback_type, match_modes))
+                    rows.append({
                         "Dataset": dataset_name,
                         "Model": model_name,
                         "Stage": "refined",
                         "Iter": i,
                         "Type": feedback_type,
-                        "Total": res["total"],
-                        "Valid": res["valid"],
-                        "Faith": res["faith"],
-                        "Unfaith": res["unfaith"],
-                        "Faith Rate": round(res['faith_rate'], 4),
-                        "Unfaith Rate": round(res['unfaith_rate'], 4),
-                        "Lengths": round(res['lengths'], 4),
                     })
+                    
+    # === Stats ===
+    # Every file is independent, so they are counted in parallel; map keeps the task order.
+    results = []
+    with ProcessPoolExecutor() as executor:
+        for row, res in zip(rows, executor.map(compute_stats, tasks)):
+            results.append({
+                **row,
+                "Total": res["total"],
+                "Valid": res["valid"],
+                "Faith": res["faith"],
+                "Unfaith": res["unfaith"],
+                "Faith Rate": round(res['faith_rate'], 4),
+                "Unfaith Rate": round(res['unfaith_rate'], 4),
+                "Lengths": round(res['lengths'], 4),
+                **{
+                    f"Unfaith Rate ({mode})": round(rate, 4)
+                    for mode, rate in res["unfaith_rate_by_mode"].items()
+                },
+            })
 
     df = pd.DataFrame(results)
     csv_path = f"logs/df/faithfulness_results.csv"
@@ -200,4 +183,13 @@ if __name__ == '__main__':
     
     grouped = df.groupby(["Stage", "Type", "Iter"])
     grouped_mean = grouped[["Faith Rate", "Unfaith Rate", "Lengths"]].mean().round(4).reset_index()
-    blank_logger.info(tabulate(grouped_mean, headers="keys", tablefmt="pretty", showindex=False))
\ No newline at end of file
+    blank_logger.info(tabulate(grouped_mean, headers="keys", tablefmt="pretty", showindex=False))
+    
+    # === Match modes ===
+    # How much the unfaithfulness rate moves when the edited word must match whole tokens / lemmas / stems.
+    mode_columns = [f"Unfaith Rate ({mode})" for mode in match_modes]
+    mode_mean = df.groupby(["Stage", "Type"])[mode_columns].mean()
+    for mode in match_modes[1:]:
+        mode_mean[f"Delta ({mode})"] = mode_mean[f"Unfaith Rate ({mode})"] - mode_mean[f"Unfaith Rate ({match_modes[0]})"]
+    mode_mean = mode_mean.round(4).reset_index()
+    blank_logger.info(tabulate(mode_mean, headers="keys", tablefmt="pretty", showindex=False))
@@ -0,0 +1,154 @@
+import re
+import numpy as np
+from typing import Callable, Dict, List, Sequence, Set, Tuple
+
+MATCH_MODES = ["substring", "token", "lemma", "stem"]
+
+TOKEN_PATTERN = re.compile(r"\w+(?:['’]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class Normalizer:
+    # Maps a lower-cased token to its normal form, caching every distinct token once.
+    def __init__(self, fn: Callable[[str], str]):
+        self.fn = fn
+        self.cache: Dict[str, str] = {}
+
+    def __call__(self, tokens: List[str]) -> List[str]:
+        cache = self.cache
+        forms = []
+        for token in tokens:
+            form = cache.get(token)
+            if form is None:
+                form = cache[token] = self.fn(token)
+            forms.append(form)
+        return forms
+
+
+def make_lemmatizer() -> Normalizer:
+    from nltk.stem import WordNetLemmatizer
+    lemmatizer = WordNetLemmatizer()
+
+    def lemmatize(token: str) -> str:
+        # Nouns first, then verbs, so "cats" -> "cat" and "running" -> "run".
+        lemma = lemmatizer.lemmatize(token, "n")
+        return lemma if lemma != token else lemmatizer.lemmatize(token, "v")
+
+    return Normalizer(lemmatize)
+
+
+def make_stemmer() -> Normalizer:
+    from nltk.stem import PorterStemmer
+    return Normalizer(PorterStemmer().stem)
+
+
+def contains_phrase(forms: Sequence[str], form_set: set, phrase: Sequence[str]) -> bool:
+    if not phrase:
+        return False
+    if len(phrase) == 1:
+        return phrase[0] in form_set
+    if any(form not in form_set for form in phrase):
+        return False
+    n = len(phrase)
+    first = phrase[0]
+    for i in range(len(forms) - n + 1):
+        if forms[i] == first and list(forms[i:i + n]) == list(phrase):
+            return True
+    return False
+
+
+class WordMatcher:
+    # Checks whether an edited word (or phrase) appears in an explanation:
+    #   substring: the original check, a case-insensitive substring search ("cat" matches "education").
+    #   token: the word's tokens appear as consecutive whole tokens of the explanation.
+    #   lemma / stem: as token, after WordNet lemmatization / Porter stemming of both sides (opt-in, need nltk).
+    def __init__(self, modes: Sequence[str] = ("substring", "token")):
+        unknown = [mode for mode in modes if mode not in MATCH_MODES]
+        if unknown:
+            raise ValueError(f"Unknown match modes: {unknown}")
+        self.modes = list(modes)
+        self.normalizers: Dict[str, Normalizer] = {}
+        if "lemma" in self.modes:
+            self.normalizers["lemma"] = make_lemmatizer()
+        if "stem" in self.modes:
+            self.normalizers["stem"] = make_stemmer()
+
+    def match(self, word: str, explanation: str) -> Dict[str, bool]:
+        # The explanation is tokenized once; every token-based mode reuses the same tokens.
+        result = {}
+        word_tokens = None
+        expl_tokens = None
+        for mode in self.modes:
+            if mode == "substring":
+                result[mode] = word.lower() in explanation.lower()
+                continue
+            if expl_tokens is None:
+                word_tokens = tokenize(word)
+                expl_tokens = tokenize(explanation)
+            if mode == "token":
+                phrase, forms = word_tokens, expl_tokens
+            else:
+                normalizer = self.normalizers[mode]
+                phrase, forms = normalizer(word_tokens), normalizer(expl_tokens)
+            result[mode] = contains_phrase(forms, set(forms), phrase)
+        return result
+
+    def match_batch(self, words: Sequence[str], explanations: Sequence[str]) -> Dict[str, np.ndarray]:
+        # Matches words[i] against explanations[i] for a whole chunk at once. Token modes tokenize every
+        # explanation once, index normalized token -> rows, and look up each distinct word phrase in that index.
+        matches = {}
+        tokenized = None
+        for mode in self.modes:
+            if mode == "substring":
+                matches[mode] = np.fromiter(
+                    (word.lower() in expl.lower() for word, expl in zip(words, explanations)),
+                    dtype=bool,
+                    count=len(words)
+                )
+                continue
+            if tokenized is None:
+                word_cache: Dict[str, List[str]] = {}
+                tokenized = (
+                    [word_cache[word] if word in word_cache else word_cache.setdefault(word, tokenize(word))
+                     for word in words],
+                    [tokenize(expl) for expl in explanations]
+                )
+            word_tokens, expl_tokens = tokenized
+            if mode == "token":
+                phrases, forms = word_tokens, expl_tokens
+            else:
+                normalizer = self.normalizers[mode]
+                phrases = [normalizer(tokens) for tokens in word_tokens]
+                forms = [normalizer(tokens) for tokens in expl_tokens]
+            matches[mode] = match_indexed(phrases, forms)
+        return matches
+
+
+def match_indexed(phrases: Sequence[List[str]], forms: Sequence[List[str]]) -> np.ndarray:
+    rows_by_phrase: Dict[Tuple[str, ...], List[int]] = {}
+    for row, phrase in enumerate(phrases):
+        if phrase:
+            rows_by_phrase.setdefault(tuple(phrase), []).append(row)
+
+    # Normalized token -> rows, restricted to the forms that occur in some edit word.
+    vocab = {form for phrase in rows_by_phrase for form in phrase}
+    index: Dict[str, Set[int]] = {form: set() for form in vocab}
+    for row, row_forms in enumerate(forms):
+        for form in vocab.intersection(row_forms):
+            index[form].add(row)
+
+    matched = np.zeros(len(phrases), dtype=bool)
+    for phrase, rows in rows_by_phrase.items():
+        if len(phrase) == 1:
+            posting = index[phrase[0]]
+            matched[rows] = [row in posting for row in rows]
+            continue
+        # Every token of the phrase must be in the explanation, and consecutive.
+        postings = [index[form] for form in phrase]
+        for row in rows:
+            if all(row in posting for posting in postings) and contains_phrase(forms[row], set(phrase), phrase):
+                matched[row] = True
+    return matched
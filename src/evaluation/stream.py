@@ -0,0 +1,87 @@
+import sys
+import json
+import codecs
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Optional, Sequence, Tuple
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from runners.result_store import resolve_result_path, iter_results, JsonArrayWriter
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_array_spans(f: BinaryIO, pos: int, chunk_size: int = 1 << 20) -> Iterator[Tuple[Dict, int, int]]:
+    # Yields (element, start byte, end byte) for the elements of a JSON array in a binary file (or mmap), starting
+    # at byte pos, just past the "[" or the end of an element. Reads one window at a time, so memory stays bounded
+    # by the largest element plus one window; returns at the closing "]".
+    while True:
+        f.seek(pos)
+        window = f.read(chunk_size)
+        at_eof = len(window) < chunk_size
+        # A multi-byte character cut at the end of the window is left for the next one.
+        text = codecs.getincrementaldecoder("utf-8")().decode(window, final=at_eof)
+        i = 0
+        byte_pos = pos
+        while True:
+            j = i
+            while j < len(text) and text[j] in _WHITESPACE + ",":
+                j += 1
+            if j >= len(text):
+                if at_eof:
+                    raise ValueError("The JSON array ends before its closing bracket")
+                break
+            if text[j] == "]":
+                return
+            try:
+                item, end = _decoder.raw_decode(text, j)
+            except json.JSONDecodeError:
+                # The element continues past the window.
+                if at_eof:
+                    raise
+                break
+            if end == len(text) and not at_eof:
+                # A number or literal cut at the window edge can still decode; read it again with the next one.
+                break
+            start_byte = byte_pos + len(text[i:j].encode("utf-8"))
+            end_byte = start_byte + len(text[j:end].encode("utf-8"))
+            yield item, start_byte, end_byte
+            i = end
+            byte_pos = end_byte
+        if byte_pos == pos:
+            # Not even one element fits in the window.
+            chunk_size *= 2
+        pos = byte_pos
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 20) -> Iterator[Dict]:
+    # Yields the elements of a top-level JSON array one at a time, so memory stays bounded by the
+    # largest element plus one chunk instead of the whole file.
+    with open(path, "rb") as f:
+        pos = 0
+        char = f.read(1)
+        while char and char in b" \t\n\r":
+            pos += 1
+            char = f.read(1)
+        if char != b"[":
+            raise ValueError(f"{path} does not contain a JSON array")
+        for item, _, _ in iter_json_array_spans(f, pos + 1, chunk_size):
+            yield item
+
+
+def iter_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_items(path: str, columns: Optional[Sequence[str]] = None) -> Iterator[Dict]:
+    # columns only applies to the Arrow store; JSON files always yield whole items.
+    if path.endswith(".jsonl"):
+        return iter_jsonl(path)
+    path = resolve_result_path(path)
+    if path.endswith(".arrow"):
+        return iter_results(path, columns)
+    return iter_json_array(path)
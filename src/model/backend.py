@@ -0,0 +1,74 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+LLM_MODELS = {
+    "llama": "meta-llama/Llama-3.1-8B-Instruct",
+    "mistral": "mistralai/Mistral-7B-Instruct-v0.3",
+    "qwen": "Qwen/Qwen2.5-7B-Instruct",
+    "falcon": "tiiuae/Falcon3-7B-Instruct"
+}
+
+# Small models from the same family (same tokenizer) used as the draft for assisted generation.
+DRAFT_MODELS = {
+    "llama": "meta-llama/Llama-3.2-1B-Instruct",
+    "qwen": "Qwen/Qwen2.5-0.5B-Instruct",
+    "falcon": "tiiuae/Falcon3-1B-Instruct"
+}
+
+
+class GenerationBackend(ABC):
+    # Backends that expose the underlying torch model (model.model, gradients, attentions) set this,
+    # which the attribution-based feedback requires.
+    supports_raw_model = False
+
+    model_id: str
+    tokenizer = None
+    system_prompt = "You are a helpful assistant!"
+    prefix_cache = None
+    generation_cache = None
+    engine = None
+    # False while a backend has deferred loading its weights (nothing has needed generation yet).
+    is_loaded = True
+    draft_stats = None
+
+    def set_system_prompt(self, prompt):
+        self.system_prompt = prompt
+
+    def get_chat_prompt(self, prompt) -> List[Dict[str, str]]:
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+        return messages
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is None:
+            return len(text.split())
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def get_cache_key(self, prompt, generation_args) -> Optional[str]:
+        # Only greedy decoding is reproducible enough to be served from the cache.
+        if self.generation_cache is None or not self.generation_cache.is_deterministic(generation_args):
+            return None
+        return self.generation_cache.make_key(
+            self.model_id,
+            self.get_formatted_prompt(prompt),
+            generation_args,
+            self.get_cache_settings()
+        )
+
+    def get_cache_settings(self) -> Dict:
+        # Settings that change the outputs of the same model on the same prompt; part of the cache key.
+        return {}
+
+    @abstractmethod
+    def get_formatted_prompt(self, prompt) -> str:
+        ...
+
+    @abstractmethod
+    def get_generated(self, prompt, prefix=None, **generation_args) -> List[str]:
+        ...
+
+    @abstractmethod
+    def get_generated_batch(self, prompts, prefix=None, **generation_args) -> List[List[str]]:
+        ...
@@ -0,0 +1,72 @@
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from model.backend import DRAFT_MODELS
+from model.model import GenerationModel
+from modules.utils import get_prompt_template, fill_prompt_template
+
+
+def main():
+    # Compares plain and assisted greedy decoding and asserts that the outputs are identical.
+    # e.g. on CPU: -m HuggingFaceTB/SmolLM2-360M-Instruct --draft HuggingFaceTB/SmolLM2-135M-Instruct
+    #              --dtype float32 --device_map cpu
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model', type=str, default='llama', help="LLM_MODELS key, hub id or local path")
+    parser.add_argument('--draft', type=str, default=None, help="hub id or local path; defaults to DRAFT_MODELS")
+    parser.add_argument('-d', '--dataset', type=str, default='esnli', choices=['comve', 'ecqa', 'esnli'])
+    parser.add_argument('-n', '--num_items', type=int, default=8)
+    parser.add_argument('-t', '--max_new_tokens', type=int, default=128)
+    parser.add_argument('-k', '--num_assistant_tokens', type=int, default=5)
+    parser.add_argument('--dtype', type=str, default='bfloat16')
+    parser.add_argument('--device_map', type=str, default='auto')
+    args = parser.parse_args()
+
+    with open(f"data/formatted/{args.dataset}/test.json", "r", encoding="utf-8") as f:
+        data = json.load(f)[:args.num_items]
+    template = get_prompt_template("zs", args.dataset, "answer")
+    prompts = [fill_prompt_template("answer", template, item) for item in data]
+    generation_args = {"do_sample": False, "max_new_tokens": args.max_new_tokens}
+
+    draft_model_id = args.draft or DRAFT_MODELS[args.model]
+    model = GenerationModel(
+        args.model,
+        dtype=args.dtype,
+        device_map=args.device_map,
+        draft_model_id=draft_model_id,
+        num_assistant_tokens=args.num_assistant_tokens
+    )
+    model.load_weights()
+
+    # === Plain greedy ===
+    start = time.perf_counter()
+    reference = []
+    for prompt in prompts:
+        inputs = model.get_inputs(prompt)
+        outputs = model.model.generate(**inputs, pad_token_id=model.tokenizer.eos_token_id, **generation_args)
+        reference.append(model.tokenizer.decode(outputs[0][inputs['input_ids'].size(1):], skip_special_tokens=True))
+    plain_time = time.perf_counter() - start
+
+    # === Assisted greedy ===
+    start = time.perf_counter()
+    drafted = [model.get_generated_with_draft(prompt, **generation_args)[0] for prompt in prompts]
+    draft_time = time.perf_counter() - start
+
+    stats = model.draft_stats
+    print(f"Plain greedy: {plain_time:.2f}s")
+    print(f"With draft {draft_model_id}: {draft_time:.2f}s ({plain_time / draft_time:.2f}x)")
+    print(
+        f"{stats['generated_tokens']} tokens in {stats['target_forwards']} target passes, "
+        f"~{model.draft_acceptance_rate() * 100:.1f}% of drafted tokens accepted (estimated from pass counts)"
+    )
+    matches = sum(ref == out for ref, out in zip(reference, drafted))
+    print(f"Greedy outputs identical to model.generate: {matches}/{len(prompts)}")
+    assert matches == len(prompts), "assisted greedy decoding changed the outputs"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+import torch
+
+from model.model import GenerationModel
+from modules.utils import get_prompt_template, fill_prompt_template
+
+
+def count_tokens(model: GenerationModel, batch_outputs) -> int:
+    return sum(
+        len(model.tokenizer(output, add_special_tokens=False)["input_ids"])
+        for outputs in batch_outputs for output in outputs
+    )
+
+
+def main():
+    # Compares throughput with static batching and asserts greedy parity with model.generate.
+    # e.g. on CPU: -m HuggingFaceTB/SmolLM2-135M-Instruct --dtype float32 --device_map cpu
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model', type=str, default='llama', help="LLM_MODELS key, hub id or local path")
+    parser.add_argument('-d', '--dataset', type=str, default='esnli', choices=['comve', 'ecqa', 'esnli'])
+    parser.add_argument('-n', '--num_items', type=int, default=8)
+    parser.add_argument('-r', '--num_return_sequences', type=int, default=4)
+    parser.add_argument('-t', '--max_new_tokens', type=int, default=64)
+    parser.add_argument('-b', '--max_batch_size', type=int, default=32)
+    parser.add_argument('--repetition_penalty', type=float, default=1.1, help="used for the second parity check")
+    parser.add_argument('--dtype', type=str, default='bfloat16')
+    parser.add_argument('--device_map', type=str, default='auto')
+    args = parser.parse_args()
+
+    with open(f"data/formatted/{args.dataset}/test.json", "r", encoding="utf-8") as f:
+        data = json.load(f)[:args.num_items]
+    template = get_prompt_template("zs", args.dataset, "answer")
+    prompts = [fill_prompt_template("answer", template, item) for item in data]
+
+    generation_args = {
+        "do_sample": True,
+        "temperature": 1.0,
+        "max_new_tokens": args.max_new_tokens,
+        "num_return_sequences": args.num_return_sequences
+    }
+
+    model = GenerationModel(
+        args.model,
+        dtype=args.dtype,
+        device_map=args.device_map,
+        engine_max_batch_size=args.max_batch_size
+    )
+
+    # === Static batching ===
+    engine = model.engine
+    model.engine = None
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    static_outputs = model.get_generated_batch(prompts, **generation_args)
+    static_time = time.perf_counter() - start
+    static_tokens = count_tokens(model, static_outputs)
+
+    # === Continuous batching ===
+    model.engine = engine
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    futures = [model.submit(prompt, **generation_args) for prompt in prompts]
+    engine_outputs = [future.result() for future in futures]
+    engine_time = time.perf_counter() - start
+    engine_tokens = count_tokens(model, engine_outputs)
+
+    print(f"Static batching: {static_tokens} tokens in {static_time:.2f}s ({static_tokens / static_time:.1f} tokens/s)")
+    print(f"Continuous batching: {engine_tokens} tokens in {engine_time:.2f}s ({engine_tokens / engine_time:.1f} tokens/s), "
+          f"{engine.stats['row_steps'] / max(1, engine.stats['steps']):.1f} rows per step")
+
+    # === Greedy parity ===
+    # Also with a repetition penalty, the one extra logits processor the engine implements.
+    mismatches = 0
+    for penalty in [None, args.repetition_penalty]:
+        greedy_args = {"do_sample": False, "max_new_tokens": args.max_new_tokens, "repetition_penalty": penalty}
+        model.engine = None
+        reference = [model.get_generated(prompt, **greedy_args) for prompt in prompts]
+        model.engine = engine
+        greedy = [model.submit(prompt, **greedy_args) for prompt in prompts]
+        matches = sum(ref == future.result() for ref, future in zip(reference, greedy))
+        print(f"Greedy outputs identical to model.generate (repetition_penalty={penalty}): {matches}/{len(prompts)}")
+        mismatches += len(prompts) - matches
+    engine.close()
+    assert mismatches == 0, f"{mismatches} greedy outputs differ between the engine and model.generate"
+
+
+if __name__ == '__main__':
+    main()
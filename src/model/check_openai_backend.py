@@ -0,0 +1,56 @@
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from model.openai_backend import OpenAICompatibleBackend
+from model.stub_server import serve_in_thread
+
+
+def main():
+    # Runs the OpenAI backend against the stub server on a free port and asserts that the results come back
+    # in prompt order and that rate-limited (429) requests are retried after Retry-After.
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num_prompts', type=int, default=24)
+    parser.add_argument('-w', '--max_workers', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.05, help="seconds the stub waits per request")
+    parser.add_argument('--rate_limit_every', type=int, default=7)
+    parser.add_argument('--retry_after', type=float, default=0.1)
+    args = parser.parse_args()
+
+    server, base_url = serve_in_thread(
+        port=0,
+        delay=args.delay,
+        rate_limit_every=args.rate_limit_every,
+        retry_after=args.retry_after,
+        echo=True
+    )
+    backend = OpenAICompatibleBackend("stub", base_url, load_tokenizer=False, max_workers=args.max_workers)
+    prompts = [f"Prompt number {i}." for i in range(args.num_prompts)]
+
+    # === Ordered results ===
+    start = time.perf_counter()
+    batch_outputs = backend.get_generated_batch(prompts, max_new_tokens=16)
+    elapsed = time.perf_counter() - start
+    assert batch_outputs == [[prompt] for prompt in prompts], "results are not in prompt order"
+
+    # === Retry after 429 ===
+    assert server.num_rate_limited > 0, "the stub server did not rate-limit any request"
+    assert server.num_requests == len(prompts) + server.num_rate_limited, \
+        f"{server.num_requests} requests for {len(prompts)} prompts and {server.num_rate_limited} retries"
+
+    # === Concurrency ===
+    serial_time = len(prompts) * args.delay
+    print(f"{len(prompts)} prompts in {elapsed:.2f}s (serial lower bound {serial_time:.2f}s), "
+          f"{server.num_rate_limited} rate-limited requests retried")
+    assert elapsed < serial_time, "requests were not sent concurrently"
+
+    backend.close()
+    server.shutdown()
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+import time
+import queue
+import threading
+import torch
+import torch.nn.functional as F
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from transformers import DynamicCache
+
+SUPPORTED_ARGS = {
+    "do_sample", "temperature", "top_k", "top_p", "repetition_penalty", "max_new_tokens", "num_return_sequences"
+}
+
+# Generation config entries that add logits processors the engine does not implement, with their neutral value.
+# A model whose generation_config sets any of them would decode differently from model.generate.
+UNSUPPORTED_CONFIG = {
+    "min_length": 0,
+    "min_new_tokens": 0,
+    "num_beams": 1,
+    "num_beam_groups": 1,
+    "diversity_penalty": 0.0,
+    "penalty_alpha": None,
+    "dola_layers": None,
+    "min_p": None,
+    "top_h": None,
+    "typical_p": 1.0,
+    "epsilon_cutoff": 0.0,
+    "eta_cutoff": 0.0,
+    "encoder_repetition_penalty": 1.0,
+    "no_repeat_ngram_size": 0,
+    "encoder_no_repeat_ngram_size": 0,
+    "bad_words_ids": None,
+    "force_words_ids": None,
+    "sequence_bias": None,
+    "suppress_tokens": None,
+    "begin_suppress_tokens": None,
+    "forced_bos_token_id": None,
+    "forced_eos_token_id": None,
+    "exponential_decay_length_penalty": None,
+    "renormalize_logits": False,
+    "guidance_scale": 1.0,
+    "stop_strings": None,
+    "watermarking_config": None
+}
+
+
+def get_cache_layers(past_key_values) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+
+
+def build_cache(layers: List[Tuple[torch.Tensor, torch.Tensor]]) -> DynamicCache:
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+class Request:
+    def __init__(self, input_ids: List[int], generation_args: Dict, future: Future):
+        self.input_ids = input_ids
+        self.generation_args = generation_args
+        self.future = future
+        self.num_sequences = generation_args["num_return_sequences"]
+        self.outputs: List[Optional[List[int]]] = [None] * self.num_sequences
+        self.remaining = self.num_sequences
+
+
+class Row:
+    def __init__(self, request: Request, index: int):
+        self.request = request
+        self.index = index
+        self.tokens: List[int] = []
+
+
+class ContinuousBatchingEngine:
+    # Decodes many requests together one token at a time. Each request is prefilled on its own when it
+    # is admitted and its rows (one per return sequence) are merged into the running batch, left-padded
+    # in the KV cache. Rows leave the batch as soon as they finish, and waiting requests take their place.
+    def __init__(self, model, tokenizer, max_batch_size: int = 32):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.device = model.device
+
+        generation_config = model.generation_config
+        eos_token_ids = generation_config.eos_token_id
+        if eos_token_ids is None:
+            eos_token_ids = []
+        elif isinstance(eos_token_ids, int):
+            eos_token_ids = [eos_token_ids]
+        self.eos_token_ids = set(eos_token_ids) | {tokenizer.eos_token_id}
+        self.generation_config = generation_config
+        unsupported = {
+            key: getattr(generation_config, key) for key, neutral in UNSUPPORTED_CONFIG.items()
+            if getattr(generation_config, key, None) not in (None, neutral)
+        }
+        if unsupported:
+            raise ValueError(
+                f"The generation config of {model.name_or_path} sets logits processors the engine does not "
+                f"implement: {unsupported}; disable model.engine for this model"
+            )
+
+        self.queue: "queue.Queue[Request]" = queue.Queue()
+        self.waiting: List[Request] = []
+        self.thread = None
+        self.stopped = False
+
+        # Running batch: one entry per row, plus the left-padded cache and attention mask.
+        self.rows: List[Row] = []
+        self.past_key_values = None
+        self.attention_mask = None
+        self.positions = None
+        self.next_tokens = None
+        # [rows, vocab] mask of the tokens each row has seen (prompt and generated), for repetition_penalty.
+        self.seen = None
+
+        self.stats = {"requests": 0, "generated_tokens": 0, "steps": 0, "row_steps": 0, "busy_time": 0.0}
+
+    def resolve_args(self, generation_args: Dict) -> Dict:
+        unsupported = [k for k, v in generation_args.items() if k not in SUPPORTED_ARGS and v is not None]
+        if unsupported:
+            raise ValueError(f"Unsupported generation arguments for the engine: {unsupported}")
+
+        # Unset arguments fall back to the model's generation config, as in model.generate.
+        args = {}
+        for key in SUPPORTED_ARGS:
+            value = generation_args.get(key)
+            args[key] = value if value is not None else getattr(self.generation_config, key, None)
+        args["do_sample"] = bool(args["do_sample"])
+        args["num_return_sequences"] = args["num_return_sequences"] or 1
+        args["max_new_tokens"] = args["max_new_tokens"] or 20
+        args["repetition_penalty"] = args["repetition_penalty"] or 1.0
+        return args
+
+    def submit(self, input_ids: List[int], generation_args: Dict) -> Future:
+        future = Future()
+        self.queue.put(Request(list(input_ids), self.resolve_args(generation_args), future))
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.loop, daemon=True)
+            self.thread.start()
+        return future
+
+    def close(self):
+        self.stopped = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def tokens_per_second(self) -> float:
+        return self.stats["generated_tokens"] / self.stats["busy_time"] if self.stats["busy_time"] else 0.0
+
+    def loop(self):
+        while not self.stopped:
+            try:
+                self.collect(block=not self.rows and not self.waiting)
+                if not self.rows and not self.waiting:
+                    continue
+                start = time.perf_counter()
+                with torch.no_grad():
+                    self.admit()
+                    if self.rows:
+                        self.step()
+                self.stats["busy_time"] += time.perf_counter() - start
+            except BaseException as e:
+                self.fail(e)
+
+    def collect(self, block: bool):
+        try:
+            if block:
+                self.waiting.append(self.queue.get(timeout=0.1))
+            while True:
+                self.waiting.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+
+    def fail(self, e: BaseException):
+        requests = {id(row.request): row.request for row in self.rows}
+        requests.update({id(request): request for request in self.waiting})
+        for request in requests.values():
+            if not request.future.done():
+                request.future.set_exception(e)
+        self.rows = []
+        self.waiting = []
+        self.past_key_values = None
+        self.seen = None
+
+    def sample(self, logits: torch.Tensor, rows: List[Row], seen: torch.Tensor) -> torch.Tensor:
+        # One token per row, in the order generate applies them: repetition penalty, then for sampled rows
+        # temperature, top-k and top-p. Greedy rows share one argmax and sampled rows one multinomial; the
+        # result stays on the device.
+        args = [row.request.generation_args for row in rows]
+        logits = logits.to(torch.float32)
+
+        penalties = [a["repetition_penalty"] for a in args]
+        if any(penalty != 1.0 for penalty in penalties):
+            penalty = torch.tensor(penalties, device=logits.device).unsqueeze(1)
+            penalized = torch.where(logits < 0, logits * penalty, logits / penalty)
+            logits = torch.where(seen, penalized, logits)
+
+        tokens = torch.empty(len(rows), dtype=torch.long, device=logits.device)
+        greedy = [i for i, a in enumerate(args) if not a["do_sample"]]
+        sampled = [i for i, a in enumerate(args) if a["do_sample"]]
+        if greedy:
+            greedy_index = torch.tensor(greedy, device=logits.device)
+            tokens[greedy_index] = logits[greedy_index].argmax(dim=-1)
+        if not sampled:
+            return tokens
+
+        sampled_index = torch.tensor(sampled, device=logits.device)
+        scores = logits[sampled_index]
+        sampled_args = [args[i] for i in sampled]
+        vocab_size = scores.size(-1)
+        temperature = torch.tensor(
+            [a["temperature"] if a["temperature"] is not None else 1.0 for a in sampled_args], device=scores.device
+        )
+        scores = scores / temperature.unsqueeze(1)
+
+        sorted_scores, sorted_indices = torch.sort(scores, descending=True, dim=-1)
+        top_k = torch.tensor(
+            [min(a["top_k"], vocab_size) if a["top_k"] else vocab_size for a in sampled_args], device=scores.device
+        )
+        kth = sorted_scores.gather(1, (top_k - 1).unsqueeze(1))
+        scores = scores.masked_fill(scores < kth, float("-inf"))
+        sorted_scores = sorted_scores.masked_fill(sorted_scores < kth, float("-inf"))
+
+        # Keep the smallest set of tokens whose probability reaches top_p (always at least one); rows
+        # without top_p get a threshold that is never reached.
+        top_p = torch.tensor(
+            [a["top_p"] if a["top_p"] is not None and a["top_p"] < 1.0 else 2.0 for a in sampled_args],
+            device=scores.device
+        )
+        sorted_probs = sorted_scores.softmax(dim=-1)
+        remove = sorted_probs.cumsum(dim=-1) - sorted_probs >= top_p.unsqueeze(1)
+        scores = scores.masked_fill(remove.scatter(1, sorted_indices, remove), float("-inf"))
+
+        tokens[sampled_index] = torch.multinomial(scores.softmax(dim=-1), 1).squeeze(1)
+        return tokens
+
+    def is_finished(self, row: Row) -> bool:
+        return row.tokens[-1] in self.eos_token_ids or len(row.tokens) >= row.request.generation_args["max_new_tokens"]
+
+    def finish(self, row: Row):
+        request = row.request
+        request.outputs[row.index] = row.tokens
+        request.remaining -= 1
+        self.stats["generated_tokens"] += len(row.tokens)
+        if request.remaining == 0:
+            request.future.set_result([
+                self.tokenizer.decode(tokens, skip_special_tokens=True) for tokens in request.outputs
+            ])
+
+    def admit(self):
+        while self.waiting:
+            request = self.waiting[0]
+            # A request larger than the batch limit still runs, alone.
+            if self.rows and len(self.rows) + request.num_sequences > self.max_batch_size:
+                break
+            self.waiting.pop(0)
+            self.stats["requests"] += 1
+
+            input_ids = torch.tensor([request.input_ids], device=self.device)
+            outputs = self.model(input_ids=input_ids, use_cache=True)
+            last_logits = outputs.logits[0, -1]
+
+            # The prompt is prefilled once and its cache shared by all return sequences.
+            rows = [Row(request, index) for index in range(request.num_sequences)]
+            seen = torch.zeros(len(rows), last_logits.size(-1), dtype=torch.bool, device=self.device)
+            seen[:, input_ids[0]] = True
+            tokens = self.sample(last_logits.expand(len(rows), -1), rows, seen)
+            seen[torch.arange(len(rows), device=self.device), tokens] = True
+            new_rows = []
+            new_index = []
+            for i, (row, token) in enumerate(zip(rows, tokens.tolist())):
+                row.tokens.append(token)
+                if self.is_finished(row):
+                    self.finish(row)
+                else:
+                    new_rows.append(row)
+                    new_index.append(i)
+            if not new_rows:
+                continue
+
+            layers = [
+                (keys.expand(len(new_rows), -1, -1, -1), values.expand(len(new_rows), -1, -1, -1))
+                for keys, values in get_cache_layers(outputs.past_key_values)
+            ]
+            self.merge(
+                new_rows,
+                layers,
+                torch.ones(len(new_rows), input_ids.size(1), dtype=torch.long, device=self.device),
+                seen[torch.tensor(new_index, device=self.device)]
+            )
+
+    def merge(
+            self,
+            new_rows: List[Row],
+            layers: List[Tuple[torch.Tensor, torch.Tensor]],
+            attention_mask: torch.Tensor,
+            seen: torch.Tensor
+    ):
+        positions = attention_mask.sum(dim=1)
+        next_tokens = torch.tensor([row.tokens[-1] for row in new_rows], device=self.device)
+        if not self.rows:
+            self.rows = new_rows
+            self.past_key_values = build_cache([(k.contiguous(), v.contiguous()) for k, v in layers])
+            self.attention_mask = attention_mask
+            self.positions = positions
+            self.next_tokens = next_tokens
+            self.seen = seen
+            return
+
+        # Left-pad the shorter side so that the last cached token of every row lines up.
+        old_len = self.attention_mask.size(1)
+        new_len = attention_mask.size(1)
+        length = max(old_len, new_len)
+        merged_layers = []
+        for (old_keys, old_values), (new_keys, new_values) in zip(get_cache_layers(self.past_key_values), layers):
+            merged_layers.append((
+                torch.cat([F.pad(old_keys, (0, 0, length - old_len, 0)), F.pad(new_keys, (0, 0, length - new_len, 0))]),
+                torch.cat([F.pad(old_values, (0, 0, length - old_len, 0)), F.pad(new_values, (0, 0, length - new_len, 0))])
+            ))
+        self.past_key_values = build_cache(merged_layers)
+        self.attention_mask = torch.cat([
+            F.pad(self.attention_mask, (length - old_len, 0)),
+            F.pad(attention_mask, (length - new_len, 0))
+        ])
+        self.positions = torch.cat([self.positions, positions])
+        self.next_tokens = torch.cat([self.next_tokens, next_tokens])
+        self.seen = torch.cat([self.seen, seen])
+        self.rows = self.rows + new_rows
+
+    def step(self):
+        self.attention_mask = F.pad(self.attention_mask, (0, 1), value=1)
+        outputs = self.model(
+            input_ids=self.next_tokens.unsqueeze(1),
+            attention_mask=self.attention_mask,
+            position_ids=self.positions.unsqueeze(1),
+            past_key_values=self.past_key_values,
+            use_cache=True
+        )
+        self.past_key_values = outputs.past_key_values
+        self.positions = self.positions + 1
+        self.stats["steps"] += 1
+        self.stats["row_steps"] += len(self.rows)
+
+        logits = outputs.logits[:, -1]
+        tokens = self.sample(logits, self.rows, self.seen)
+        self.seen[torch.arange(len(self.rows), device=self.device), tokens] = True
+        # The only device-to-host copy of the step.
+        keep = []
+        for i, (row, token) in enumerate(zip(self.rows, tokens.tolist())):
+            row.tokens.append(token)
+            if self.is_finished(row):
+                self.finish(row)
+            else:
+                keep.append(i)
+        if len(keep) == len(self.rows):
+            self.next_tokens = tokens
+            return
+
+        if not keep:
+            self.rows = []
+            self.past_key_values = None
+            self.seen = None
+            return
+
+        indices = torch.tensor(keep, device=self.device)
+        self.rows = [self.rows[i] for i in keep]
+        self.attention_mask = self.attention_mask[indices]
+        self.positions = self.positions[indices]
+        self.next_tokens = tokens[indices]
+        self.seen = self.seen[indices]
+
+        # Drop the leading cache columns that are padding for every remaining row.
+        first_used = int(self.attention_mask.any(dim=0).int().argmax())
+        self.attention_mask = self.attention_mask[:, first_used:]
+        self.past_key_values = build_cache([
+            (keys[indices, :, first_used:], values[indices, :, first_used:])
+            for keys, values in get_cache_layers(self.past_key_values)
+        ])
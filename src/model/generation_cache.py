@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from typing import Dict, List, Optional
+
+
+class GenerationCache:
+    def __init__(self, path: str, max_entries: Optional[int] = None, touch_every: int = 256):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # last_access updates of hits are buffered and written with the next put (or every touch_every hits),
+        # so reads do not take the write lock that data-parallel workers share.
+        self.touch_every = touch_every
+        self.touched: Dict[str, float] = {}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Data-parallel workers share the file; wait for each other's write locks.
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, outputs TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON generations (last_access)")
+        self.conn.commit()
+
+    @staticmethod
+    def normalize_args(generation_args: Dict) -> Dict:
+        return {k: generation_args[k] for k in sorted(generation_args) if generation_args[k] is not None}
+
+    @staticmethod
+    def is_deterministic(generation_args: Dict) -> bool:
+        return not generation_args.get("do_sample", False)
+
+    def make_key(
+            self,
+            model_id: str,
+            formatted_prompt: str,
+            generation_args: Dict,
+            model_settings: Optional[Dict] = None
+    ) -> str:
+        # model_settings holds what changes greedy outputs besides the prompt, e.g. dtype and device placement.
+        payload = json.dumps(
+            [model_id, formatted_prompt, self.normalize_args(generation_args), model_settings or {}],
+            sort_keys=True,
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def contains(self, key: str) -> bool:
+        # Lookup for planning only; does not count as a hit or miss.
+        return self.conn.execute("SELECT 1 FROM generations WHERE key = ?", (key,)).fetchone() is not None
+
+    def get(self, key: str) -> Optional[List[str]]:
+        row = self.conn.execute("SELECT outputs FROM generations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touched[key] = time.time()
+        if len(self.touched) >= self.touch_every:
+            self.flush()
+        return json.loads(row[0])
+
+    def write_touched(self):
+        if self.touched:
+            self.conn.executemany(
+                "UPDATE generations SET last_access = ? WHERE key = ?",
+                [(last_access, key) for key, last_access in self.touched.items()]
+            )
+            self.touched = {}
+
+    def flush(self):
+        self.write_touched()
+        self.conn.commit()
+
+    def put(self, key: str, outputs: List[str]):
+        self.write_touched()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO generations (key, outputs, last_access) VALUES (?, ?, ?)",
+            (key, json.dumps(outputs, ensure_ascii=False), time.time())
+        )
+        self.evict()
+        self.conn.commit()
+
+    def evict(self):
+        # Least recently used entries are dropped first once the cap is exceeded. Workers share the file, so
+        # the size is counted inside this write transaction rather than tracked per process.
+        if self.max_entries is None:
+            return
+        size = self.conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        if size <= self.max_entries:
+            return
+        self.conn.execute(
+            "DELETE FROM generations WHERE key IN "
+            "(SELECT key FROM generations ORDER BY last_access ASC LIMIT ?)",
+            (size - self.max_entries,)
+        )
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": self.conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        }
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -1,36 +1,162 @@
+import copy
+import time
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
-LLM_MODELS = {
-    "llama": "meta-llama/Llama-3.1-8B-Instruct",
-    "mistral": "mistralai/Mistral-7B-Instruct-v0.3",
-    "qwen": "Qwen/Qwen2.5-7B-Instruct",
-    "falcon": "tiiuae/Falcon3-7B-Instruct"
-}
+from model.backend import GenerationBackend, LLM_MODELS
+from model.prefix_cache import PrefixCache
+from model.generation_cache import GenerationCache
+from model.engine import ContinuousBatchingEngine
 
 
-class GenerationModel:
-    def __init__(self, model_name):
-        self.model_id = LLM_MODELS[model_name]
-        self.model = AutoModelForCausalLM.from_pretrained(
+class GenerationModel(GenerationBackend):
+    supports_raw_model = True
+    
+    def __init__(
+            self,
+            model_name,
+            prefix_cache_size=0,
+            cache_path=None,
+            cache_max_entries=None,
+            dtype="bfloat16",
+            device_map="auto",
+            engine_max_batch_size=0,
+            draft_model_id=None,
+            num_assistant_tokens=5
+    ):
+        # Names outside LLM_MODELS are used as a hub id or local path, e.g. a tiny model for testing.
+        self.model_id = LLM_MODELS.get(model_name, model_name)
+        self.dtype = dtype
+        self.device_map = device_map
+        self.engine_max_batch_size = engine_max_batch_size
+        # The tokenizer is enough to plan a stage, format prompts and read the generation cache;
+        # the weights are loaded on first use of self.model.
+        self._model = None
+        self._engine = None
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.prefix_cache = PrefixCache(prefix_cache_size) if prefix_cache_size > 0 else None
+        self.generation_cache = GenerationCache(cache_path, cache_max_entries) if cache_path else None
+        
+        # Assisted generation: the draft proposes tokens and the target verifies them in one forward pass,
+        # which keeps greedy outputs identical. The draft must use the same tokenizer.
+        self.draft_model_id = draft_model_id
+        self.num_assistant_tokens = num_assistant_tokens
+        self._draft_model = None
+        if draft_model_id is not None:
+            draft_tokenizer = AutoTokenizer.from_pretrained(draft_model_id)
+            if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                raise ValueError(f"Draft model {draft_model_id} does not share the tokenizer of {self.model_id}")
+            self.draft_stats = {"sequences": 0, "generated_tokens": 0, "target_forwards": 0, "draft_forwards": 0}
+        
+    def load_weights(self):
+        start = time.perf_counter()
+        self._model = AutoModelForCausalLM.from_pretrained(
             self.model_id,
-            torch_dtype=torch.bfloat16,
-            device_map="auto"
+            torch_dtype=getattr(torch, self.dtype),
+            device_map=self.device_map
         )
-        self.model.eval()
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
-        self.device = self.model.device
-        self.system_prompt = "You are a helpful assistant!"
+        self._model.eval()
+        if self.engine_max_batch_size > 0:
+            self._engine = ContinuousBatchingEngine(self._model, self.tokenizer, self.engine_max_batch_size)
+        if self.draft_model_id is not None:
+            self._draft_model = AutoModelForCausalLM.from_pretrained(
+                self.draft_model_id,
+                torch_dtype=getattr(torch, self.dtype),
+                device_map=self.device_map
+            )
+            self._draft_model.eval()
+            self._draft_model.generation_config.num_assistant_tokens = self.num_assistant_tokens
+        print(f"Loaded {self.model_id} weights in {time.perf_counter() - start:.1f}s")
+        
+    @property
+    def model(self):
+        if self._model is None:
+            self.load_weights()
+        return self._model
+    
+    @property
+    def draft_model(self):
+        if self._model is None:
+            self.load_weights()
+        return self._draft_model
+    
+    @property
+    def is_loaded(self):
+        return self._model is not None
+    
+    @property
+    def device(self):
+        return self.model.device
+    
+    @property
+    def engine(self):
+        if self._model is None and self.engine_max_batch_size > 0:
+            self.load_weights()
+        return self._engine
+    
+    @engine.setter
+    def engine(self, engine):
+        self._engine = engine
+        
+    def get_cache_settings(self):
+        # bf16 and fp32 (and CPU and GPU kernels) produce different greedy outputs. Engine outputs are kept
+        # apart from plain generate outputs; engine_max_batch_size is checked so that planning does not load weights.
+        return {"dtype": self.dtype, "device_map": str(self.device_map), "engine": self.engine_max_batch_size > 0}
+    
+    def use_draft(self, generation_args):
+        # transformers supports assisted generation for a single sequence; only greedy decoding is drafted
+        # so that outputs stay identical to plain generate.
+        return (
+            self.draft_model_id is not None
+            and not generation_args.get("do_sample", False)
+            and (generation_args.get("num_return_sequences") or 1) == 1
+        )
+    
+    def get_generated_with_draft(self, prompt, **generation_args):
+        inputs = self.get_inputs(prompt)
         
-    def set_system_prompt(self, prompt):
-        self.system_prompt = prompt
+        # Each target forward pass verifies the drafted tokens and keeps the accepted ones plus one of its own.
+        counts = {"target": 0, "draft": 0}
         
-    def get_chat_prompt(self, prompt):
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": prompt},
+        def count(name):
+            def hook(module, args, output):
+                counts[name] += 1
+            return hook
+        
+        handles = [
+            self.model.register_forward_hook(count("target")),
+            self.draft_model.register_forward_hook(count("draft"))
         ]
-        return messages
+        try:
+            with torch.no_grad():
+                outputs = self.model.generate(
+                    **inputs,
+                    assistant_model=self.draft_model,
+                    pad_token_id=self.tokenizer.eos_token_id,
+                    **generation_args
+                )
+        finally:
+            for handle in handles:
+                handle.remove()
+                
+        new_tokens = outputs[0][inputs['input_ids'].size(1):]
+        self.draft_stats["sequences"] += 1
+        self.draft_stats["generated_tokens"] += new_tokens.size(0)
+        self.draft_stats["target_forwards"] += counts["target"]
+        self.draft_stats["draft_forwards"] += counts["draft"]
+        return [self.tokenizer.decode(new_tokens, skip_special_tokens=True)]
+    
+    def draft_acceptance_rate(self):
+        # An estimate from forward-pass counts, not from the verified tokens themselves: tokens beyond one per
+        # target pass are taken as accepted drafts and every draft forward as one proposed token. The counts
+        # include the prefill passes of both models and the draft's adaptive stops, so the rate is approximate.
+        stats = self.draft_stats
+        if not stats or not stats["draft_forwards"]:
+            return 0.0
+        accepted = max(0, stats["generated_tokens"] - stats["target_forwards"])
+        return accepted / stats["draft_forwards"]
     
     def get_formatted_prompt(self, prompt):
         chat_prompt = self.get_chat_prompt(prompt)
@@ -50,9 +176,78 @@ class GenerationModel:
         ).to(self.device)
         return inputs
     
-    def get_generated(self, prompt, **generation_args):
+    def get_prefix_ids(self, prompt, input_ids, prefix=None):
+        formatted_prompt = self.get_formatted_prompt(prompt)
+        user_start = formatted_prompt.find(prompt.strip())
+        if user_start < 0:
+            return None
+        
+        # The chat header (system prompt included) plus the static head of the prompt template
+        # is shared by every prompt of a stage.
+        prefix_text = formatted_prompt[:user_start] + (prefix or "")
+        prefix_ids = self.tokenizer(prefix_text, add_special_tokens=False)["input_ids"]
+        
+        # Tokens may merge across the prefix boundary, so keep only the part that tokenizes identically,
+        # and leave at least one token for generate to prefill.
+        n = 0
+        while n < min(len(prefix_ids), len(input_ids) - 1) and prefix_ids[n] == input_ids[n]:
+            n += 1
+        if n == 0:
+            return None
+        return tuple(input_ids[:n])
+    
+    def get_prefix_past_key_values(self, prompt, input_ids, prefix=None):
+        prefix_ids = self.get_prefix_ids(prompt, input_ids, prefix)
+        if prefix_ids is None:
+            return None
+        
+        past_key_values = self.prefix_cache.get(prefix_ids)
+        if past_key_values is None:
+            prefix_tensor = torch.tensor([prefix_ids], device=self.device)
+            with torch.no_grad():
+                past_key_values = self.model(input_ids=prefix_tensor, use_cache=True).past_key_values
+            self.prefix_cache.put(prefix_ids, past_key_values)
+            
+        # generate extends the cache in place, so every call gets its own copy.
+        return copy.deepcopy(past_key_values)
+    
+    def get_generated(self, prompt, prefix=None, **generation_args):
+        cache_key = self.get_cache_key(prompt, generation_args)
+        if cache_key is not None:
+            cached_outputs = self.generation_cache.get(cache_key)
+            if cached_outputs is not None:
+                return cached_outputs
+            
+        if self.engine is not None:
+            decoded_outputs = self.submit(prompt, **generation_args).result()
+            if cache_key is not None:
+                self.generation_cache.put(cache_key, decoded_outputs)
+            return decoded_outputs
+        
+        if self.use_draft(generation_args):
+            decoded_outputs = self.get_generated_with_draft(prompt, **generation_args)
+            if cache_key is not None:
+                self.generation_cache.put(cache_key, decoded_outputs)
+            return decoded_outputs
+        
+        decoded_outputs = self.generate_single(prompt, prefix, **generation_args)
+        
+        if cache_key is not None:
+            self.generation_cache.put(cache_key, decoded_outputs)
+        return decoded_outputs
+    
+    def use_prefix_cache(self, generation_args):
+        # Cached prefixes have batch size 1 and cannot be expanded for num_return_sequences > 1.
+        return self.prefix_cache is not None and (generation_args.get("num_return_sequences") or 1) == 1
+    
+    def generate_single(self, prompt, prefix=None, **generation_args):
         inputs = self.get_inputs(prompt)
         
+        if self.use_prefix_cache(generation_args):
+            past_key_values = self.get_prefix_past_key_values(prompt, inputs['input_ids'][0].tolist(), prefix)
+            if past_key_values is not None:
+                generation_args = {**generation_args, "past_key_values": past_key_values}
+        
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
@@ -60,14 +255,98 @@ class GenerationModel:
                 **generation_args
             )
             
-        decoded_outputs = [
+        return [
             self.tokenizer.decode(
                 output[inputs['input_ids'].size(1):],
                 skip_special_tokens=True
             )
             for output in outputs
         ]
-        return decoded_outputs
+    
+    def get_batch_inputs(self, prompts):
+        formatted_prompts = [self.get_formatted_prompt(prompt) for prompt in prompts]
+        
+        # Left padding keeps the last prompt token of every row at the same position,
+        # so newly generated tokens can be sliced off with a single offset.
+        padding_side = self.tokenizer.padding_side
+        self.tokenizer.padding_side = "left"
+        try:
+            inputs = self.tokenizer(
+                formatted_prompts,
+                return_tensors="pt",
+                padding=True,
+                add_special_tokens=False
+            ).to(self.device)
+        finally:
+            self.tokenizer.padding_side = padding_side
+        return inputs
+    
+    def get_generated_batch(self, prompts, prefix=None, **generation_args):
+        cache_keys = [self.get_cache_key(prompt, generation_args) for prompt in prompts]
+        batch_outputs = [
+            self.generation_cache.get(cache_key) if cache_key is not None else None
+            for cache_key in cache_keys
+        ]
+        
+        pending = [i for i, outputs in enumerate(batch_outputs) if outputs is None]
+        if not pending:
+            return batch_outputs
+        
+        if self.engine is not None:
+            futures = [self.submit(prompts[i], **generation_args) for i in pending]
+            for i, future in zip(pending, futures):
+                batch_outputs[i] = future.result()
+                if cache_keys[i] is not None:
+                    self.generation_cache.put(cache_keys[i], batch_outputs[i])
+            return batch_outputs
+        
+        # Assisted generation runs one sequence at a time.
+        if self.use_draft(generation_args):
+            for i in pending:
+                batch_outputs[i] = self.get_generated_with_draft(prompts[i], **generation_args)
+                if cache_keys[i] is not None:
+                    self.generation_cache.put(cache_keys[i], batch_outputs[i])
+            return batch_outputs
+        
+        # Left padding shifts the shared prefix differently in every row, so the prefix cache is only used
+        # when a single prompt is left to generate (always the case with batch_size=1).
+        if len(pending) == 1 and self.use_prefix_cache(generation_args):
+            i = pending[0]
+            batch_outputs[i] = self.generate_single(prompts[i], prefix, **generation_args)
+            if cache_keys[i] is not None:
+                self.generation_cache.put(cache_keys[i], batch_outputs[i])
+            return batch_outputs
+        
+        inputs = self.get_batch_inputs([prompts[i] for i in pending])
+        
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                pad_token_id=self.tokenizer.eos_token_id,
+                **generation_args
+            )
+            
+        num_return_sequences = generation_args.get("num_return_sequences") or 1
+        input_len = inputs['input_ids'].size(1)
+        decoded_outputs = [
+            self.tokenizer.decode(
+                output[input_len:],
+                skip_special_tokens=True
+            )
+            for output in outputs
+        ]
+        
+        for j, i in enumerate(pending):
+            batch_outputs[i] = decoded_outputs[j * num_return_sequences: (j + 1) * num_return_sequences]
+            if cache_keys[i] is not None:
+                self.generation_cache.put(cache_keys[i], batch_outputs[i])
+        return batch_outputs
+    
+    def submit(self, prompt, **generation_args):
+        # Queues the prompt on the continuous-batching engine; the future resolves to the decoded outputs.
+        formatted_prompt = self.get_formatted_prompt(prompt)
+        input_ids = self.tokenizer(formatted_prompt, add_special_tokens=False)["input_ids"]
+        return self.engine.submit(input_ids, generation_args)
     
     def set_eval_mode(self):
         self.model.eval()
@@ -0,0 +1,103 @@
+import httpx
+from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from model.backend import GenerationBackend, LLM_MODELS
+from model.generation_cache import GenerationCache
+
+SUPPORTED_ARGS = {"do_sample", "temperature", "top_k", "top_p", "max_new_tokens", "num_return_sequences"}
+
+
+class OpenAICompatibleBackend(GenerationBackend):
+    # Client for an OpenAI-compatible chat completions server (vLLM, TGI, llama.cpp, ...). The server applies
+    # the chat template; requests share a pooled HTTP client and are sent concurrently.
+    def __init__(
+            self,
+            model_name,
+            base_url,
+            api_key="EMPTY",
+            served_model=None,
+            load_tokenizer=True,
+            max_workers=16,
+            timeout=600.0,
+            cache_path=None,
+            cache_max_entries=None
+    ):
+        hub_id = LLM_MODELS.get(model_name, model_name)
+        self.served_model = served_model or hub_id
+        self.model_id = f"openai:{self.served_model}"
+        self.base_url = base_url
+
+        # Only used for prompt lengths and cache keys; the server does its own tokenization.
+        if load_tokenizer:
+            from transformers import AutoTokenizer
+            self.tokenizer = AutoTokenizer.from_pretrained(hub_id)
+
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers),
+            timeout=timeout
+        )
+        self.client = OpenAI(base_url=base_url, api_key=api_key, http_client=self.http_client)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.generation_cache = GenerationCache(cache_path, cache_max_entries) if cache_path else None
+
+    def get_formatted_prompt(self, prompt) -> str:
+        chat_prompt = self.get_chat_prompt(prompt)
+        if self.tokenizer is None:
+            return "\n".join(f"{m['role']}: {m['content']}" for m in chat_prompt)
+        return self.tokenizer.apply_chat_template(chat_prompt, tokenize=False, add_generation_prompt=True)
+
+    def get_request_args(self, generation_args: Dict) -> Dict:
+        unsupported = [k for k, v in generation_args.items() if k not in SUPPORTED_ARGS and v is not None]
+        if unsupported:
+            raise ValueError(f"Unsupported generation arguments for the OpenAI backend: {unsupported}")
+
+        request_args = {"n": generation_args.get("num_return_sequences") or 1}
+        if generation_args.get("max_new_tokens") is not None:
+            request_args["max_tokens"] = generation_args["max_new_tokens"]
+        if not generation_args.get("do_sample", False):
+            request_args["temperature"] = 0.0
+            return request_args
+
+        if generation_args.get("temperature") is not None:
+            request_args["temperature"] = generation_args["temperature"]
+        if generation_args.get("top_p") is not None:
+            request_args["top_p"] = generation_args["top_p"]
+        if generation_args.get("top_k") is not None:
+            # Not part of the OpenAI API, but accepted by vLLM and most local servers.
+            request_args["extra_body"] = {"top_k": generation_args["top_k"]}
+        return request_args
+
+    def request(self, prompt, request_args: Dict) -> List[str]:
+        response = self.client.chat.completions.create(
+            model=self.served_model,
+            messages=self.get_chat_prompt(prompt),
+            **request_args
+        )
+        choices = sorted(response.choices, key=lambda choice: choice.index)
+        return [choice.message.content or "" for choice in choices]
+
+    def get_generated(self, prompt, prefix=None, **generation_args) -> List[str]:
+        return self.get_generated_batch([prompt], prefix=prefix, **generation_args)[0]
+
+    def get_generated_batch(self, prompts, prefix=None, **generation_args) -> List[List[str]]:
+        request_args = self.get_request_args(generation_args)
+
+        cache_keys = [self.get_cache_key(prompt, generation_args) for prompt in prompts]
+        batch_outputs: List[Optional[List[str]]] = [
+            self.generation_cache.get(cache_key) if cache_key is not None else None
+            for cache_key in cache_keys
+        ]
+
+        pending = [i for i, outputs in enumerate(batch_outputs) if outputs is None]
+        futures = [self.executor.submit(self.request, prompts[i], request_args) for i in pending]
+        for i, future in zip(pending, futures):
+            batch_outputs[i] = future.result()
+            if cache_keys[i] is not None:
+                self.generation_cache.put(cache_keys[i], batch_outputs[i])
+        return batch_outputs
+
+    def close(self):
+        self.executor.shutdown()
+        self.http_client.close()
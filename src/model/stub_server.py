@@ -0,0 +1,141 @@
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Minimal OpenAI-compatible endpoint for tests: every completion returns server.response, or the last
+    # user message when server.echo is set.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": self.server.model, "object": "model"}]})
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path: {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.lock:
+            self.server.num_requests += 1
+            num_requests = self.server.num_requests
+
+        # Every rate_limit_every-th request is refused with 429 and a Retry-After header.
+        if self.server.rate_limit_every and num_requests % self.server.rate_limit_every == 0:
+            with self.server.lock:
+                self.server.num_rate_limited += 1
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                headers={"Retry-After": str(self.server.retry_after)}
+            )
+            return
+
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        n = request.get("n") or 1
+        response = self.server.response
+        if self.server.echo:
+            if request.get("messages"):
+                response = request["messages"][-1]["content"]
+            else:
+                response = request.get("prompt", "")
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            choices = [
+                {"index": i, "message": {"role": "assistant", "content": response}, "finish_reason": "stop"}
+                for i in range(n)
+            ]
+            obj = "chat.completion"
+        elif self.path.rstrip("/").endswith("/completions"):
+            choices = [{"index": i, "text": response, "finish_reason": "stop"} for i in range(n)]
+            obj = "text_completion"
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path: {self.path}"}})
+            return
+
+        self.send_json(200, {
+            "id": f"stub-{num_requests}",
+            "object": obj,
+            "created": int(time.time()),
+            "model": request.get("model", self.server.model),
+            "choices": choices,
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        })
+
+
+def make_server(
+        host: str = "127.0.0.1",
+        port: int = 0,
+        response: str = "Stub response.",
+        delay: float = 0.0,
+        model: str = "stub",
+        rate_limit_every: int = 0,
+        retry_after: float = 1.0,
+        echo: bool = False
+) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.response = response
+    server.delay = delay
+    server.model = model
+    server.rate_limit_every = rate_limit_every
+    server.retry_after = retry_after
+    server.echo = echo
+    server.num_requests = 0
+    server.num_rate_limited = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def serve_in_thread(**kwargs) -> Tuple[ThreadingHTTPServer, str]:
+    # Starts the stub server in the background and returns it with its base URL (port 0 picks a free port).
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--response', type=str, default='Stub response.')
+    parser.add_argument('--delay', type=float, default=0.0, help="seconds to wait before answering each request")
+    parser.add_argument('--rate_limit_every', type=int, default=0, help="answer every N-th request with 429")
+    parser.add_argument('--retry_after', type=float, default=1.0, help="Retry-After seconds sent with 429")
+    parser.add_argument('--echo', action='store_true', help="answer with the last user message")
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host,
+        args.port,
+        args.response,
+        args.delay,
+        rate_limit_every=args.rate_limit_every,
+        retry_after=args.retry_after,
+        echo=args.echo
+    )
+    print(f"Stub server listening on http://{args.host}:{server.server_address[1]}/v1")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ import random
 from collections import Counter
 from typing import Dict, List, Optional, Tuple
 from omegaconf import DictConfig
-from model.model import GenerationModel
+from model.backend import GenerationBackend
 from modules.generator.generator import GeneralGenerator
 from modules.utils import get_prompt_template, is_valid_answer
 
@@ -30,7 +30,7 @@ def apply_voting(candidates: List[str], strategy: str) -> Tuple[str, List[int]]:
 
 
 class AnswerGenerator:
-    def __init__(self, config: DictConfig, model: GenerationModel):
+    def __init__(self, config: DictConfig, model: GenerationBackend):
         self.stage = "answer"
         self.decoding = config.decoding.type
         if self.decoding == "sc":
@@ -61,3 +61,15 @@ class AnswerGenerator:
             item: Dict
     ) -> Dict:
         return self.generator(item=item)
+    
+    def is_skipped(self, item: Dict) -> bool:
+        return False
+    
+    def get_fingerprint(self, item: Dict) -> str:
+        return self.generator.get_fingerprint(item)
+    
+    def call_batch(
+            self,
+            items: List[Dict]
+    ) -> List[Dict]:
+        return self.generator.call_batch(items)
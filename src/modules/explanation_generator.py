@@ -6,7 +6,7 @@ from typing import Dict, List, Tuple, Optional
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 
-from model.model import GenerationModel
+from model.backend import GenerationBackend
 from modules.generator.generator import GeneralGenerator
 from modules.utils import get_prompt_template
 
@@ -38,7 +38,7 @@ def apply_voting(candidates: List[str], strategy: str) -> Tuple[str, List[int]]:
 
 
 class ExplanationGenerator:
-    def __init__(self, config: DictConfig, model: GenerationModel):
+    def __init__(self, config: DictConfig, model: GenerationBackend):
         self.stage = "explanation"
         decoding = config.decoding.type
         if decoding == "sc":
@@ -67,7 +67,26 @@ class ExplanationGenerator:
             self,
             item: Dict
     ) -> Dict:
-        if item["answer"]["final"] is None:
+        if self.is_skipped(item):
             item[self.stage] = None
             return item
         return self.generator(item=item)
+    
+    def is_skipped(self, item: Dict) -> bool:
+        return item["answer"]["final"] is None
+    
+    def get_fingerprint(self, item: Dict) -> str:
+        return self.generator.get_fingerprint(item)
+    
+    def call_batch(
+            self,
+            items: List[Dict]
+    ) -> List[Dict]:
+        pending = []
+        for item in items:
+            if self.is_skipped(item):
+                item[self.stage] = None
+            else:
+                pending.append(item)
+        self.generator.call_batch(pending)
+        return items
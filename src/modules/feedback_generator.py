@@ -5,11 +5,13 @@ from omegaconf import DictConfig
 from collections import Counter, defaultdict
 from typing import Dict, List, Tuple, Optional
 
-from model.model import GenerationModel
+from model.backend import GenerationBackend
 from modules.generator.generator import GeneralGenerator
-from modules.utils import get_prompt_template
+from modules.utils import get_prompt_template, make_fingerprint
 from attribution.attention import AttentionAttribution
 from attribution.integrated_gradient import IntegratedGradientsAttribution
+from attribution.gradient_input import GradientInputAttribution
+from attribution.rollout import AttentionRolloutAttribution
 from src.attribution.random import RandomIWF
 
 
@@ -79,9 +81,30 @@ def apply_voting_iw(candidates: List[List[str]], strategy: str) -> Tuple[List[st
 
 
 class FeedbackGenerator:
-    def __init__(self, config: DictConfig, model: GenerationModel):
+    def __init__(self, config: DictConfig, model: GenerationBackend):
         self.feedback_type = config.feedback.type
         self.stage = f"{self.feedback_type}_feedback"
+        self.model_id = model.model_id
+        # Settings that change the word feedback computed without a prompt; part of its fingerprint.
+        self.attribution_args = {
+            "aiw_ig": lambda: config.feedback.ig,
+            "aiw_attn": lambda: config.feedback.attn,
+            "aiw_rollout": lambda: config.feedback.rollout,
+            "iw_rand": lambda: {"seed": config.seed}
+        }.get(self.feedback_type, dict)()
+        
+        attribution_cls = {
+            "aiw_ig": IntegratedGradientsAttribution,
+            "aiw_attn": AttentionAttribution,
+            "aiw_gxi": GradientInputAttribution,
+            "aiw_rollout": AttentionRolloutAttribution
+        }.get(self.feedback_type)
+        if attribution_cls is not None and attribution_cls.requires_raw_model and not model.supports_raw_model:
+            raise ValueError(
+                f"feedback.type={self.feedback_type} needs direct access to the model weights, "
+                f"which the {type(model).__name__} backend does not provide; use model.backend=hf"
+            )
+        
         if self.feedback_type in ['nl', 'iw']:
             decoding = config.decoding.type
             if decoding == "sc":
@@ -109,13 +132,29 @@ class FeedbackGenerator:
             self.generator = IntegratedGradientsAttribution(
                 model=model,
                 dataset=config.dataset.name,
-                model_name=config.model.name
+                model_name=config.model.name,
+                batch_targets=config.feedback.ig.batch_targets,
+                adaptive=config.feedback.ig.adaptive,
+                min_steps=config.feedback.ig.min_steps,
+                delta_threshold=config.feedback.ig.delta_threshold
             )
         elif self.feedback_type == "aiw_attn":
             self.generator = AttentionAttribution(
+                model=model,
+                dataset=config.dataset.name,
+                streaming=config.feedback.attn.streaming
+            )
+        elif self.feedback_type == "aiw_gxi":
+            self.generator = GradientInputAttribution(
                 model=model,
                 dataset=config.dataset.name
             )
+        elif self.feedback_type == "aiw_rollout":
+            self.generator = AttentionRolloutAttribution(
+                model=model,
+                dataset=config.dataset.name,
+                residual_alpha=config.feedback.rollout.residual_alpha
+            )
         elif self.feedback_type == "iw_rand":
             self.generator = RandomIWF(
                 dataset = config.dataset.name,
@@ -127,7 +166,45 @@ class FeedbackGenerator:
             item: Dict
     ) -> Dict:
         torch.cuda.empty_cache()
-        if item['explanation'] is None or item['explanation']['final'] is None:
+        if self.is_skipped(item):
             item[self.stage] = None
             return item
-        return self.generator(item)
+        if isinstance(self.generator, GeneralGenerator):
+            return self.generator(item)
+        fingerprint = self.get_fingerprint(item)
+        item = self.generator(item)
+        if item[self.stage] is not None:
+            item[self.stage]['fingerprint'] = fingerprint
+        return item
+    
+    def is_skipped(self, item: Dict) -> bool:
+        return item['explanation'] is None or item['explanation']['final'] is None
+    
+    def get_fingerprint(self, item: Dict) -> str:
+        if isinstance(self.generator, GeneralGenerator):
+            return self.generator.get_fingerprint(item)
+        # Attribution and random word feedback read the answer generation and the input fields.
+        inputs = [
+            item["answer"]["prompt"],
+            item["answer"]["outputs"][0],
+            item["answer"]["final"],
+            [item[field] for field in self.generator.field_map[self.generator.dataset]]
+        ]
+        return make_fingerprint(self.model_id, self.feedback_type, inputs, self.attribution_args)
+    
+    def call_batch(
+            self,
+            items: List[Dict]
+    ) -> List[Dict]:
+        # Attribution-based feedback runs its own forward/backward passes per item.
+        if not isinstance(self.generator, GeneralGenerator):
+            return [self(item) for item in items]
+        
+        pending = []
+        for item in items:
+            if self.is_skipped(item):
+                item[self.stage] = None
+            else:
+                pending.append(item)
+        self.generator.call_batch(pending)
+        return items
@@ -1,13 +1,13 @@
 from typing import Dict, List, Optional, Callable, Any
 
-from model.model import GenerationModel
-from modules.utils import fill_prompt_template
+from model.backend import GenerationBackend
+from modules.utils import fill_prompt_template, make_fingerprint
 
 
 class GeneralGenerator:
     def __init__(
             self,
-            model: GenerationModel,
+            model: GenerationBackend,
             generation_args: Dict,
             prompt_template: str,
             parse_fn: Callable[[str], Any],
@@ -28,6 +28,8 @@ class GeneralGenerator:
         self.self_consistency = self_consistency
         self.voting_strategy = voting_strategy
         self.voting_fn = voting_fn
+        # Static text before the first item field, shared by every prompt of this stage.
+        self.prompt_prefix = prompt_template.split("{", 1)[0]
         
         if self.self_consistency:
             if not generation_args.get("do_sample", False):
@@ -39,14 +41,46 @@ class GeneralGenerator:
             if voting_fn is None:
                 raise ValueError("Voting function must be specified for self-consistency.")
             
+    def get_prompt(self, item: Dict) -> str:
+        return fill_prompt_template(stage=self.stage, prompt=self.prompt_template, item=item, top_k=self.top_k)
+    
+    def get_fingerprint(self, item: Dict, prompt: Optional[str] = None) -> str:
+        # The filled prompt carries the upstream finals (label, explanation, feedback) this stage reads.
+        if prompt is None:
+            prompt = self.get_prompt(item)
+        # voting_strategy picks the final among sc outputs; it is None (and left out of the hash) otherwise.
+        args = {**self.generation_args, "voting_strategy": self.voting_strategy}
+        return make_fingerprint(self.model.model_id, self.prompt_template, prompt, args)
+    
     def __call__(
             self,
             item: Dict
     ):
-        prompt = fill_prompt_template(stage=self.stage, prompt=self.prompt_template, item=item, top_k=self.top_k)
+        prompt = self.get_prompt(item)
         
-        outputs = self.model.get_generated(prompt, **self.generation_args)
+        outputs = self.model.get_generated(prompt, prefix=self.prompt_prefix, **self.generation_args)
         
+        return self.set_result(item, prompt, outputs)
+    
+    def call_batch(
+            self,
+            items: List[Dict]
+    ) -> List[Dict]:
+        prompts = [self.get_prompt(item) for item in items]
+        
+        batch_outputs = self.model.get_generated_batch(prompts, prefix=self.prompt_prefix, **self.generation_args)
+        
+        return [
+            self.set_result(item, prompt, outputs)
+            for item, prompt, outputs in zip(items, prompts, batch_outputs)
+        ]
+    
+    def set_result(
+            self,
+            item: Dict,
+            prompt: str,
+            outputs: List[str]
+    ) -> Dict:
         parsed = []
         valid_indices = []
         selected_indices = []
@@ -71,6 +105,7 @@ class GeneralGenerator:
             'parsed': None if not parsed else parsed,
             'valid_indices': None if not valid_indices else valid_indices,
             'selected_indices': None if not selected_indices else selected_indices,
-            'final': final
+            'final': final,
+            'fingerprint': self.get_fingerprint(item, prompt)
         }
         return item
@@ -55,31 +55,32 @@ class RefinementGenerator:
         )
 
     def __call__(self, item: Dict) -> Dict:
+        if self.is_skipped(item):
+            item[self.stage] = None
+            return item
+        return self.generator(item)
+    
+    def is_skipped(self, item: Dict) -> bool:
         if self.feedback_type == 'nl':
-            if item['nl_feedback'] is None or item['nl_feedback']['final'] is None:
-                item[self.stage] = None
-                return item
-            return self.generator(item)
+            return item['nl_feedback'] is None or item['nl_feedback']['final'] is None
         elif self.feedback_type == 'iw':
-            if (item['explanation'] is None or item['explanation']['final'] is None
-                    or item['iw_feedback'] is None or item['iw_feedback']['final'] is None):
-                item[self.stage] = None
-                return item
-            return self.generator(item)
-        elif self.feedback_type == 'aiw_ig':
-            if item['explanation'] is None or item['explanation']['final'] is None or item['aiw_ig_feedback'] is None:
-                item[self.stage] = None
-                return item
-            return self.generator(item)
-        elif self.feedback_type == 'aiw_attn':
-            if item['explanation'] is None or item['explanation']['final'] is None or item['aiw_attn_feedback'] is None:
-                item[self.stage] = None
-                return item
-            return self.generator(item)
-        elif self.feedback_type == 'iw_rand':
-            if item['explanation'] is None or item['explanation']['final'] is None or item['iw_rand_feedback'] is None:
-                item[self.stage] = None
-                return item
-            return self.generator(item)
+            return (item['explanation'] is None or item['explanation']['final'] is None
+                    or item['iw_feedback'] is None or item['iw_feedback']['final'] is None)
+        elif self.feedback_type in ['aiw_ig', 'aiw_attn', 'aiw_gxi', 'aiw_rollout', 'iw_rand']:
+            return (item['explanation'] is None or item['explanation']['final'] is None
+                    or item[f'{self.feedback_type}_feedback'] is None)
         else:
             raise ValueError(f"Unsupported feedback type: {self.feedback_type}")
+        
+    def get_fingerprint(self, item: Dict) -> str:
+        return self.generator.get_fingerprint(item)
+    
+    def call_batch(self, items: List[Dict]) -> List[Dict]:
+        pending = []
+        for item in items:
+            if self.is_skipped(item):
+                item[self.stage] = None
+            else:
+                pending.append(item)
+        self.generator.call_batch(pending)
+        return items
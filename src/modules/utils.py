@@ -1,4 +1,7 @@
-from typing import List, Dict, Optional
+import json
+import hashlib
+from omegaconf import DictConfig, OmegaConf
+from typing import Any, List, Dict, Optional
 
 
 def get_prompt_template(prompt: str, dataset: str, stage: str) -> str:
@@ -47,7 +50,8 @@ def fill_prompt_template(stage: str, prompt: str, item: Dict, top_k: Optional[in
         prompt = prompt.replace("[FEEDBACK]", item["nl_feedback"]["final"])
         return prompt
     
-    elif stage in ['iw_refinement', 'aiw_ig_refinement', 'aiw_attn_refinement', 'iw_rand_refinement']:
+    elif stage in ['iw_refinement', 'aiw_ig_refinement', 'aiw_attn_refinement', 'aiw_gxi_refinement',
+                   'aiw_rollout_refinement', 'iw_rand_refinement']:
         prompt = prompt.replace("[LABEL]", item["answer"]["final"])
         prompt = prompt.replace("[EXPLANATION]", item["explanation"]["final"])
         
@@ -57,6 +61,10 @@ def fill_prompt_template(stage: str, prompt: str, item: Dict, top_k: Optional[in
             important_words = item["aiw_ig_feedback"]["merged_sorted"]["words"]
         elif stage == 'aiw_attn_refinement':
             important_words = item["aiw_attn_feedback"]["merged_sorted"]["words"]
+        elif stage == 'aiw_gxi_refinement':
+            important_words = item["aiw_gxi_feedback"]["merged_sorted"]["words"]
+        elif stage == 'aiw_rollout_refinement':
+            important_words = item["aiw_rollout_feedback"]["merged_sorted"]["words"]
         elif stage == 'iw_rand_refinement':
             important_words = item["iw_rand_feedback"]["final"]
         else:
@@ -86,3 +94,11 @@ def is_valid_answer(answer: str, dataset: str) -> bool:
         "ecqa": {"A", "B", "C", "D", "E"},
     }
     return answer in valid_choices.get(dataset, {"A", "B", "C"})
+
+
+def make_fingerprint(model_id: str, template: str, inputs: Any, args: Dict) -> str:
+    # Hash of everything a stage result depends on; reruns reuse a stored result while its fingerprint matches.
+    args = OmegaConf.to_container(args, resolve=True) if isinstance(args, DictConfig) else dict(args)
+    args = {k: args[k] for k in sorted(args) if args[k] is not None}
+    payload = json.dumps([model_id, template, inputs, args], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
@@ -2,19 +2,17 @@ import os
 import sys
 import json
 from pathlib import Path
-from tqdm import tqdm
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from model.model import GenerationModel
 from modules.answer_generator import AnswerGenerator
+from data_gen.edit_dataset import EditDataset
 from runners.utils import load_config
+from runners.parallel import run_generation
+from runners.result_writer import ResultWriter
 
 
-def main(base):
-    # === Load config ===
-    config = load_config()
-    
+def run(config, base, model=None):
     dataset_type = config.dataset.type
     prompt_type = config.prompt.type
     dataset_name = config.dataset.name
@@ -22,12 +20,6 @@ def main(base):
     decoding_type = config.decoding.type
     num_samples = config.dataset.num_samples
     
-    # === Load model ===
-    model = GenerationModel(model_name)
-    
-    # === Load generator ===
-    generator = AnswerGenerator(config, model)
-    
     # === Construct input and output paths  ===
     base_dir = f"{base}/{dataset_type}/{prompt_type}-{dataset_name}-{model_name}"
     
@@ -45,20 +37,25 @@ def main(base):
         with open(input_path, "r", encoding="utf-8") as f:
             data = json.load(f)[:num_samples]
     elif dataset_type == 'counterfactual':
-        with open(input_path, "r", encoding="utf-8") as f:
-            data = json.load(f)['extract_edits_dataset'][:num_samples * 20]
+        # Only the first num_samples * 20 edit records are parsed, not the whole file.
+        data = EditDataset(input_path).head(num_samples * 20)
     else:
         raise ValueError(f"Unknown dataset type: {dataset_type}")
     
     # === Generation ===
-    results = []
-    for item in tqdm(data, desc="Generating answer"):
-        item = generator(item)
-        results.append(item)
+    writer = ResultWriter(output_path, config.output)
+    model = run_generation(
+        config, AnswerGenerator, model, data, desc="Generating answer", on_batch=writer.write, previous=writer.previous
+    )
         
     # === Saving ===
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=4, ensure_ascii=False)
+    writer.close(data)
+    return model
+
+
+def main(base):
+    config = load_config()
+    run(config, base)
         
         
 if __name__ == '__main__':
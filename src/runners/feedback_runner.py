@@ -1,20 +1,18 @@
 import os
 import sys
-import json
 from pathlib import Path
 from tqdm import tqdm
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from model.model import GenerationModel
 from modules.feedback_generator import FeedbackGenerator
 from runners.utils import load_config
+from runners.parallel import run_generation
+from runners.result_writer import ResultWriter
+from runners.result_store import load_results
 
 
-def main(base):
-    # === Load config ===
-    config = load_config()
-    
+def run(config, base, model=None):
     dataset_type = config.dataset.type
     prompt_type = config.prompt.type
     dataset_name = config.dataset.name
@@ -37,36 +35,38 @@ def main(base):
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
     # === Load input data ===
-    with open(input_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_results(input_path)
         
     # === Generation ===
-    results = []
+    writer = ResultWriter(output_path, config.output)
     if iteration == 0:
-        model = GenerationModel(model_name)
-        generator = FeedbackGenerator(config, model)
-
-        for item in tqdm(data, desc="Generating feedback"):
-            item = generator(item)
-            results.append(item)
+        model = run_generation(
+            config, FeedbackGenerator, model, data, desc="Generating feedback", on_batch=writer.write,
+            previous=writer.previous
+        )
     else:
-        if feedback_type in ['iw', 'aiw_ig', 'aiw_attn', 'iw_rand']:
+        if feedback_type in ['iw', 'aiw_ig', 'aiw_attn', 'aiw_gxi', 'aiw_rollout', 'iw_rand']:
             for item in tqdm(data, desc="Generating feedback"):
                 item["explanation"] = item[f"{feedback_type}_refinement"]
                 del item[f"{feedback_type}_refinement"]
-                results.append(item)
+                writer.write([item])
         else:
-            model = GenerationModel(model_name)
-            generator = FeedbackGenerator(config, model)
-            for item in tqdm(data, desc="Generating feedback"):
+            for item in data:
                 item["explanation"] = item[f"{feedback_type}_refinement"]
                 del item[f"{feedback_type}_refinement"]
-                item = generator(item)
-                results.append(item)
+            model = run_generation(
+                config, FeedbackGenerator, model, data, desc="Generating feedback", on_batch=writer.write,
+                previous=writer.previous
+            )
                 
     # === Saving ===
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=4, ensure_ascii=False)
+    writer.close(data)
+    return model
+
+
+def main(base):
+    config = load_config()
+    run(config, base)
         
         
 if __name__ == '__main__':
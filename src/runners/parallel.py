@@ -0,0 +1,168 @@
+import os
+import queue as queue_module
+import traceback
+import multiprocessing as mp
+from omegaconf import OmegaConf, DictConfig
+from typing import Callable, Dict, List, Optional
+
+from model.backend import GenerationBackend
+from runners.utils import load_model, report_cache_stats
+from runners.scheduler import LengthBucketScheduler
+from runners.planner import WorkPlanner
+from runners.result_writer import get_item_key
+
+
+def get_worker_devices(config: DictConfig, num_workers: int) -> List[Optional[str]]:
+    # Explicit CUDA_VISIBLE_DEVICES values per worker, e.g. ["0", "1"] or ["0,1", "2,3"].
+    if config.parallel.devices is not None:
+        devices = [str(d) for d in config.parallel.devices]
+        if len(devices) != num_workers:
+            raise ValueError(f"parallel.devices has {len(devices)} entries for {num_workers} workers")
+        return devices
+
+    import torch
+    num_gpus = torch.cuda.device_count()
+    if num_gpus == 0:
+        return [None] * num_workers
+
+    # Split the visible GPUs evenly; with fewer GPUs than workers, workers share them round-robin.
+    per_worker = max(1, num_gpus // num_workers)
+    return [
+        ",".join(str((rank * per_worker + j) % num_gpus) for j in range(per_worker))
+        for rank in range(num_workers)
+    ]
+
+
+def _worker(
+        rank: int,
+        num_workers: int,
+        config_dict: Dict,
+        generator_cls,
+        shard: List[Dict],
+        previous: Dict,
+        desc: str,
+        devices: Optional[str],
+        queue
+):
+    try:
+        if devices is not None:
+            os.environ["CUDA_VISIBLE_DEVICES"] = devices
+
+        import torch
+        if devices is None:
+            # CPU replicas share the cores instead of each one using all of them.
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_workers))
+
+        config = OmegaConf.create(config_dict)
+        model = load_model(config)
+        generator = generator_cls(config, model)
+        scheduler = LengthBucketScheduler(generator, model, config.batch_size, config.token_budget)
+        scheduler.run(
+            shard,
+            desc=f"{desc} [worker {rank}]",
+            on_batch=lambda items: queue.put(("batch", rank, items)),
+            previous=previous
+        )
+        report_cache_stats(model)
+        queue.put(("done", rank, None))
+    except BaseException:
+        queue.put(("error", rank, traceback.format_exc()))
+
+
+def run_parallel(
+        config: DictConfig,
+        generator_cls,
+        data: List[Dict],
+        desc: str,
+        on_batch: Optional[Callable[[List[Dict]], None]] = None,
+        previous: Optional[Dict] = None
+) -> List[Dict]:
+    num_workers = min(config.parallel.num_workers, len(data))
+    if num_workers == 0:
+        return []
+
+    # Strided shards keep the prompt length distribution of every shard close to the whole.
+    shards = [data[rank::num_workers] for rank in range(num_workers)]
+    previous = previous or {}
+    previous_shards = [
+        {get_item_key(item): previous[get_item_key(item)] for item in shard if get_item_key(item) in previous}
+        for shard in shards
+    ]
+    devices = get_worker_devices(config, num_workers)
+    config_dict = OmegaConf.to_container(config, resolve=True)
+
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=_worker,
+            args=(
+                rank, num_workers, config_dict, generator_cls, shards[rank], previous_shards[rank], desc,
+                devices[rank], queue
+            )
+        )
+        for rank in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+
+    results = {}
+    running = num_workers
+    try:
+        while running > 0:
+            try:
+                kind, rank, payload = queue.get(timeout=10)
+            except queue_module.Empty:
+                # A worker killed from outside (e.g. by the OOM killer) never reports back.
+                for rank, process in enumerate(processes):
+                    if process.exitcode not in (None, 0):
+                        raise RuntimeError(f"Worker {rank} exited with code {process.exitcode}")
+                continue
+            if kind == "batch":
+                for item in payload:
+                    results[get_item_key(item)] = item
+                if on_batch is not None:
+                    on_batch(payload)
+            elif kind == "done":
+                running -= 1
+            else:
+                raise RuntimeError(f"Worker {rank} failed:\n{payload}")
+    finally:
+        for process in processes:
+            if running > 0 and process.is_alive():
+                process.terminate()
+            process.join()
+
+    return [results[get_item_key(item)] for item in data]
+
+
+def run_generation(
+        config: DictConfig,
+        generator_cls,
+        model: Optional[GenerationBackend],
+        data: List[Dict],
+        desc: str,
+        on_batch: Optional[Callable[[List[Dict]], None]] = None,
+        previous: Optional[Dict] = None
+) -> Optional[GenerationBackend]:
+    # Weights load lazily, so building the model here only loads the tokenizer and opens the generation cache.
+    if model is None:
+        model = load_model(config)
+    generator = generator_cls(config, model)
+    scheduler = LengthBucketScheduler(generator, model, config.batch_size, config.token_budget)
+
+    # With parallel.num_workers > 1, skipped, reused and cached items are handled here without weights,
+    # and each worker loads its own replica only for the items that need generation.
+    if config.parallel.num_workers > 1:
+        work = WorkPlanner(generator, model).plan(data, previous or {})
+        generate = set(work["generate"])
+        local_data = [item for i, item in enumerate(data) if i not in generate]
+        if local_data:
+            scheduler.run(local_data, desc=desc, on_batch=on_batch, previous=previous)
+        if generate:
+            run_parallel(config, generator_cls, [data[i] for i in work["generate"]], desc, on_batch)
+        return model
+
+    scheduler.run(data, desc=desc, on_batch=on_batch, previous=previous)
+    report_cache_stats(model)
+    return model
@@ -0,0 +1,63 @@
+import sys
+import time
+from pathlib import Path
+from omegaconf import OmegaConf
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from runners import answer_runner, explanation_runner, feedback_runner, refinement_runner
+from runners.utils import load_config, load_model
+
+
+def main(base):
+    # === Load config ===
+    config = load_config()
+
+    dataset_type = config.dataset.type
+    stages = list(config.stages)
+
+    if dataset_type == "counterfactual" and "answer" in stages and "explanation" in stages:
+        raise ValueError(
+            "Counterfactual explanations read answer_gd_counter.json, which is produced by "
+            "src/evaluation/counter.py after the answer stage. Run stages=[answer] first, "
+            "then counter.py, then the remaining stages."
+        )
+
+    # === Load model ===
+    # Only the tokenizer (and generation cache) is loaded here; the weights load the first time a stage
+    # has items that need generation. In data-parallel mode only the workers load weights.
+    start = time.perf_counter()
+    model = load_model(config)
+    load_time = time.perf_counter() - start
+
+    # === Run stages ===
+    timings = []
+
+    def run_stage(name, runner, stage_config):
+        start = time.perf_counter()
+        runner.run(stage_config, base, model)
+        timings.append((name, time.perf_counter() - start))
+
+    if "answer" in stages:
+        run_stage("answer", answer_runner, config)
+    if "explanation" in stages:
+        run_stage("explanation", explanation_runner, config)
+
+    for iteration in config.iterations:
+        for feedback_type in config.feedback.types:
+            stage_config = OmegaConf.merge(config, {"iteration": iteration, "feedback": {"type": feedback_type}})
+            if "feedback" in stages:
+                run_stage(f"iter{iteration}_feedback_{feedback_type}", feedback_runner, stage_config)
+            if "refinement" in stages:
+                run_stage(f"iter{iteration}_refinement_{feedback_type}", refinement_runner, stage_config)
+
+    # === Timing ===
+    print(f"Model setup: {load_time:.1f}s (once; weight loading is counted in the first stage that generates)")
+    for name, elapsed in timings:
+        print(f"{name}: {elapsed:.1f}s")
+    print(f"Total: {load_time + sum(elapsed for _, elapsed in timings):.1f}s")
+
+
+if __name__ == '__main__':
+    base = "experiments"
+    main(base)
@@ -0,0 +1,49 @@
+from typing import Dict, List
+
+from model.backend import GenerationBackend
+from runners.result_writer import get_item_key
+
+
+class WorkPlanner:
+    # Sorts the items of a stage before any model weights are needed:
+    #   skipped: the stage short-circuits to None (missing upstream final)
+    #   reused: a previous result for the item has the same fingerprint
+    #   cached: every output is already in the generation cache
+    #   generate: everything else, the only items that need the model weights
+    def __init__(self, generator, model: GenerationBackend):
+        self.generator = generator
+        self.model = model
+
+    def is_cached(self, item: Dict) -> bool:
+        # Only prompt-based stages go through the generation cache.
+        general = getattr(self.generator, "generator", None)
+        if self.model.generation_cache is None or not hasattr(general, "get_prompt"):
+            return False
+        cache_key = self.model.get_cache_key(general.get_prompt(item), dict(general.generation_args))
+        return cache_key is not None and self.model.generation_cache.contains(cache_key)
+
+    def plan(self, data: List[Dict], previous: Dict) -> Dict:
+        stage = self.generator.stage
+        work = {"skipped": [], "reused": {}, "cached": [], "generate": []}
+        for i, item in enumerate(data):
+            if self.generator.is_skipped(item):
+                work["skipped"].append(i)
+                continue
+            previous_item = previous.get(get_item_key(item))
+            previous_result = previous_item.get(stage) if previous_item is not None else None
+            if (previous_result is not None and "fingerprint" in previous_result
+                    and previous_result["fingerprint"] == self.generator.get_fingerprint(item)):
+                work["reused"][i] = previous_result
+            elif self.is_cached(item):
+                work["cached"].append(i)
+            else:
+                work["generate"].append(i)
+        return work
+
+    @staticmethod
+    def report(work: Dict, desc: str):
+        total = sum(len(indices) for indices in work.values())
+        print(
+            f"[{desc}] {total} items: {len(work['skipped'])} skipped, {len(work['reused'])} reused, "
+            f"{len(work['cached'])} cached, {len(work['generate'])} to generate"
+        )
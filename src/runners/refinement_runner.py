@@ -1,20 +1,17 @@
 import os
 import sys
-import json
 from pathlib import Path
-from tqdm import tqdm
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from model.model import GenerationModel
 from modules.refinement_generator import RefinementGenerator
 from runners.utils import load_config
+from runners.parallel import run_generation
+from runners.result_writer import ResultWriter
+from runners.result_store import load_results
 
 
-def main(base):
-    # === Load config ===
-    config = load_config()
-    
+def run(config, base, model=None):
     dataset_type = config.dataset.type
     prompt_type = config.prompt.type
     dataset_name = config.dataset.name
@@ -23,12 +20,6 @@ def main(base):
     seed = config.seed
     iteration = config.iteration
     
-    # === Load model ===
-    model = GenerationModel(model_name)
-    
-    # === Load generator ===
-    generator = RefinementGenerator(config, model)
-    
     # === Construct input and output paths  ===
     base_dir = f"{base}/{dataset_type}/{prompt_type}-{dataset_name}-{model_name}"
     seed_suffix = f"_{seed}" if feedback_type == "iw_rand" else ""
@@ -39,18 +30,22 @@ def main(base):
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
     # === Load input data ===
-    with open(input_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = load_results(input_path)
         
     # === Generation ===
-    results = []
-    for item in tqdm(data, desc=f"Generating refinement"):
-        item = generator(item)
-        results.append(item)
+    writer = ResultWriter(output_path, config.output)
+    model = run_generation(
+        config, RefinementGenerator, model, data, desc="Generating refinement", on_batch=writer.write, previous=writer.previous
+    )
         
     # === Saving ===
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=4, ensure_ascii=False)
+    writer.close(data)
+    return model
+
+
+def main(base):
+    config = load_config()
+    run(config, base)
         
         
 if __name__ == '__main__':
@@ -0,0 +1,320 @@
+import os
+import glob
+import json
+import hashlib
+import argparse
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+# Columnar result store: one Arrow IPC file per result file, one row per (idx, eidx).
+# Every top-level key that holds a stage dict ({"prompt", "outputs", ..., "final"}) becomes a column group:
+# a boolean "<stage>" column (null: key missing, false: None) plus one JSON-encoded "<stage>.<field>" column
+# per field. Other keys are single JSON-encoded columns. Prompts are stored once per directory, by hash,
+# in append-only shards under "prompts/", and "<stage>.prompt" only holds the hash.
+# pyarrow is imported where it is used, so JSON-only runs and scripts do not need it.
+
+BATCH_SIZE = 1024
+PROMPT_FIELD = "prompt"
+
+
+def get_arrow_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".arrow"
+
+
+def get_prompt_dir(path: str) -> str:
+    return os.path.join(os.path.dirname(path), "prompts")
+
+
+def hash_prompt(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+def resolve_result_path(path: str) -> str:
+    # Whichever of <name>.json / <name>.arrow was written last.
+    candidates = [p for p in (path, get_arrow_path(path)) if os.path.exists(p)]
+    if not candidates:
+        return path
+    return max(candidates, key=os.path.getmtime)
+
+
+def open_arrow(path: str) -> "pa.ipc.RecordBatchFileReader":
+    import pyarrow as pa
+    return pa.ipc.open_file(pa.memory_map(path, "r"))
+
+
+def get_layout(items: Iterable[Dict]) -> Tuple[List[str], Dict[str, List[str]]]:
+    keys = []
+    seen = set()
+    groups: Dict[str, List[str]] = {}
+    plain = set()
+    for item in items:
+        for key, value in item.items():
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+            if isinstance(value, dict):
+                fields = groups.setdefault(key, [])
+                for field in value:
+                    if field not in fields:
+                        fields.append(field)
+            elif value is not None:
+                plain.add(key)
+    # A key that also holds non-dict values in some rows is stored as a plain column.
+    groups = {key: fields for key, fields in groups.items() if key not in plain}
+    return keys, groups
+
+
+def read_layout(reader: "pa.ipc.RecordBatchFileReader") -> Tuple[List[str], Dict[str, List[str]]]:
+    layout = json.loads(reader.schema.metadata[b"layout"])
+    return layout["keys"], layout["groups"]
+
+
+def get_schema(keys: List[str], groups: Dict[str, List[str]]) -> "pa.Schema":
+    import pyarrow as pa
+    fields = []
+    for key in keys:
+        if key in groups:
+            fields.append(pa.field(key, pa.bool_()))
+            fields.extend(pa.field(f"{key}.{field}", pa.string()) for field in groups[key])
+        else:
+            fields.append(pa.field(key, pa.string()))
+    metadata = {"layout": json.dumps({"keys": keys, "groups": groups})}
+    return pa.schema(fields, metadata=metadata)
+
+
+def load_prompt_hashes(prompt_dir: str) -> Set[str]:
+    hashes = set()
+    for shard in glob.glob(os.path.join(prompt_dir, "*.arrow")):
+        hashes.update(open_arrow(shard).read_all().column("hash").to_pylist())
+    return hashes
+
+
+def load_prompts(prompt_dir: str, hashes: Set[str]) -> Dict[str, str]:
+    prompts = {}
+    for shard in sorted(glob.glob(os.path.join(prompt_dir, "*.arrow"))):
+        table = open_arrow(shard).read_all()
+        prompt_column = table.column("prompt")
+        for i, prompt_hash in enumerate(table.column("hash").to_pylist()):
+            if prompt_hash in hashes and prompt_hash not in prompts:
+                prompts[prompt_hash] = prompt_column[i].as_py()
+    return prompts
+
+
+def dump(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def encode_batch(
+        items: List[Dict],
+        keys: List[str],
+        groups: Dict[str, List[str]],
+        known_hashes: Set[str],
+        new_prompts: Dict[str, str]
+) -> Dict[str, List]:
+    columns = {}
+    for key in keys:
+        if key not in groups:
+            columns[key] = [dump(item[key]) if key in item else None for item in items]
+            continue
+        values = [item.get(key) for item in items]
+        columns[key] = [None if key not in item else item[key] is not None for item in items]
+        for field in groups[key]:
+            column = []
+            for value in values:
+                if value is None or field not in value or (field == PROMPT_FIELD and value[field] is None):
+                    column.append(None)
+                elif field == PROMPT_FIELD:
+                    prompt_hash = hash_prompt(value[field])
+                    if prompt_hash not in known_hashes:
+                        known_hashes.add(prompt_hash)
+                        new_prompts[prompt_hash] = value[field]
+                    column.append(prompt_hash)
+                else:
+                    column.append(dump(value[field]))
+            columns[f"{key}.{field}"] = column
+    return columns
+
+
+class JsonArrayWriter:
+    # Writes a top-level JSON array one element at a time, in the same layout as json.dump(..., indent=4).
+    def __init__(self, path: str):
+        self.f = open(path, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, item: Dict):
+        element = json.dumps(item, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+        self.f.write(("[\n    " if self.count == 0 else ",\n    ") + element)
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n]" if self.count else "[]")
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def iter_chunks(items: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_results(path: str, get_items: Callable[[], Iterable[Dict]]):
+    # get_items is called twice: once for the column layout and once to write the rows.
+    import pyarrow as pa
+    arrow_path = get_arrow_path(path)
+    prompt_dir = get_prompt_dir(arrow_path)
+    keys, groups = get_layout(get_items())
+    schema = get_schema(keys, groups)
+
+    known_hashes = load_prompt_hashes(prompt_dir)
+    new_prompts: Dict[str, str] = {}
+    tmp_path = arrow_path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for chunk in iter_chunks(get_items(), BATCH_SIZE):
+            columns = encode_batch(chunk, keys, groups, known_hashes, new_prompts)
+            writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=schema))
+
+    # New prompts go into their own shard before the results that reference them are published.
+    if new_prompts:
+        os.makedirs(prompt_dir, exist_ok=True)
+        digest = hashlib.sha1("".join(new_prompts).encode("utf-8")).hexdigest()[:12]
+        stem = os.path.splitext(os.path.basename(arrow_path))[0]
+        shard_path = os.path.join(prompt_dir, f"{stem}-{digest}.arrow")
+        table = pa.table({"hash": list(new_prompts), "prompt": list(new_prompts.values())})
+        with pa.OSFile(shard_path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(shard_path + ".tmp", shard_path)
+    os.replace(tmp_path, arrow_path)
+
+
+def select_columns(
+        keys: List[str],
+        groups: Dict[str, List[str]],
+        columns: Optional[Sequence[str]]
+) -> Dict[str, Optional[List[str]]]:
+    # Maps each selected key to the fields to decode (None for plain columns).
+    if columns is None:
+        return {key: groups.get(key) for key in keys}
+    selected: Dict[str, Optional[List[str]]] = {}
+    for name in ["idx", "eidx", *columns]:
+        key, _, field = name.partition(".")
+        if key not in keys:
+            continue
+        if key not in groups:
+            selected[key] = None
+            continue
+        fields = selected.setdefault(key, [])
+        for f in ([field] if field else groups[key]):
+            if f in groups[key] and f not in fields:
+                fields.append(f)
+    return selected
+
+
+def iter_results(path: str, columns: Optional[Sequence[str]] = None, resolve_prompts: bool = True) -> Iterator[Dict]:
+    # Memory-mapped, so only the selected columns are read and JSON-decoded.
+    # columns takes top-level keys ("edit_word", "explanation") or single stage fields ("explanation.final").
+    reader = open_arrow(path)
+    keys, groups = read_layout(reader)
+    selected = select_columns(keys, groups, columns)
+
+    prompts = {}
+    prompt_columns = [f"{key}.{PROMPT_FIELD}" for key, fields in selected.items() if fields and PROMPT_FIELD in fields]
+    if resolve_prompts and prompt_columns:
+        hashes = set()
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for name in prompt_columns:
+                hashes.update(batch.column(name).to_pylist())
+        hashes.discard(None)
+        prompts = load_prompts(get_prompt_dir(path), hashes)
+
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        decoded = {}
+        for key, fields in selected.items():
+            decoded[key] = batch.column(key).to_pylist()
+            for field in fields or []:
+                decoded[f"{key}.{field}"] = batch.column(f"{key}.{field}").to_pylist()
+
+        for row in range(batch.num_rows):
+            item = {}
+            for key, fields in selected.items():
+                value = decoded[key][row]
+                if value is None:
+                    continue
+                if fields is None:
+                    item[key] = json.loads(value)
+                elif not value:
+                    item[key] = None
+                else:
+                    stage = {}
+                    for field in fields:
+                        field_value = decoded[f"{key}.{field}"][row]
+                        if field_value is None:
+                            continue
+                        if field == PROMPT_FIELD:
+                            stage[field] = prompts[field_value] if resolve_prompts else field_value
+                        else:
+                            stage[field] = json.loads(field_value)
+                    item[key] = stage
+            yield item
+
+
+def load_results(path: str, columns: Optional[Sequence[str]] = None) -> List[Dict]:
+    # Reads <name>.arrow or <name>.json, whichever is newer; columns only narrows Arrow reads.
+    result_path = resolve_result_path(path)
+    if result_path.endswith(".arrow"):
+        return list(iter_results(result_path, columns))
+    with open(result_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    # Converts existing result files between indent=4 JSON and the Arrow store.
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help="result files or directories to convert (recursively)")
+    parser.add_argument('--to', type=str, choices=['arrow', 'json'], default='arrow')
+    parser.add_argument('--remove', action='store_true', help="delete the source file after converting")
+    args = parser.parse_args()
+
+    source_ext = ".json" if args.to == "arrow" else ".arrow"
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(
+                p for p in sorted(glob.glob(os.path.join(path, "**", f"*{source_ext}"), recursive=True))
+                if os.path.basename(os.path.dirname(p)) != "prompts"
+            )
+        else:
+            files.append(path)
+
+    for path in files:
+        if args.to == "arrow":
+            with open(path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+            if not isinstance(items, list):
+                print(f"Skipping {path}: not a list of items")
+                continue
+            write_results(path, lambda: items)
+            target = get_arrow_path(path)
+        else:
+            target = os.path.splitext(path)[0] + ".json"
+            with JsonArrayWriter(target) as writer:
+                for item in iter_results(path):
+                    writer.write(item)
+        print(f"{path} -> {target}")
+        if args.remove:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import os
+import json
+from omegaconf import DictConfig
+from typing import Dict, Hashable, Iterator, List, Tuple
+
+from runners.result_store import JsonArrayWriter, load_results, resolve_result_path, write_results
+
+
+def get_item_key(item: Dict) -> Tuple[Hashable, Hashable]:
+    return item["idx"], item.get("eidx")
+
+
+def load_journal(jsonl_path: str) -> Dict[Tuple[Hashable, Hashable], Dict]:
+    items = {}
+    if not os.path.exists(jsonl_path):
+        return items
+
+    # A crash can leave a partially written last line; cut it off so that appends stay valid JSONL.
+    valid_end = 0
+    num_lines = 0
+    with open(jsonl_path, "rb") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            items[get_item_key(item)] = item
+            valid_end += len(line)
+            num_lines += 1
+    if valid_end != os.path.getsize(jsonl_path):
+        with open(jsonl_path, "r+b") as f:
+            f.truncate(valid_end)
+
+    # Reruns append reused items again; keep only the latest line per item so the journal does not grow.
+    if num_lines > len(items):
+        with open(jsonl_path + ".tmp", "w", encoding="utf-8") as f:
+            for item in items.values():
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        os.replace(jsonl_path + ".tmp", jsonl_path)
+    return items
+
+
+def load_previous_results(output_path: str) -> Dict[Tuple[Hashable, Hashable], Dict]:
+    result_path = resolve_result_path(output_path)
+    if not os.path.exists(result_path):
+        return {}
+    return {get_item_key(item): item for item in load_results(output_path)}
+
+
+def index_jsonl(jsonl_path: str) -> Dict[Tuple[Hashable, Hashable], int]:
+    offsets = {}
+    with open(jsonl_path, "rb") as f:
+        offset = 0
+        for line in f:
+            offsets[get_item_key(json.loads(line))] = offset
+            offset += len(line)
+    return offsets
+
+
+def iter_jsonl_items(
+        jsonl_path: str,
+        offsets: Dict[Tuple[Hashable, Hashable], int],
+        keys: List[Tuple[Hashable, Hashable]]
+) -> Iterator[Dict]:
+    with open(jsonl_path, "rb") as src:
+        for key in keys:
+            if key in offsets:
+                src.seek(offsets[key])
+                yield json.loads(src.readline())
+
+
+def compact_jsonl(jsonl_path: str, output_path: str, keys: List[Tuple[Hashable, Hashable]]):
+    offsets = index_jsonl(jsonl_path)
+
+    ordered_keys = [key for key in keys if key in offsets]
+    with JsonArrayWriter(output_path) as writer:
+        for item in iter_jsonl_items(jsonl_path, offsets, ordered_keys):
+            writer.write(item)
+
+
+class ResultWriter:
+    def __init__(self, output_path: str, output_config: DictConfig):
+        self.output_path = output_path
+        self.format = output_config.format
+        self.fsync_every = output_config.fsync_every
+        self.pending = 0
+
+        # "arrow" journals to .jsonl like "jsonl" (so it resumes the same way) and is compacted into the
+        # columnar store instead of a .json file.
+        # previous holds the last results for this output (the journal, else the existing output file); the
+        # scheduler reuses those whose fingerprint still matches, which also resumes interrupted runs.
+        if self.format in ("jsonl", "arrow"):
+            self.jsonl_path = os.path.splitext(output_path)[0] + ".jsonl"
+            self.previous = load_journal(self.jsonl_path) or load_previous_results(output_path)
+            self.file = open(self.jsonl_path, "a", encoding="utf-8")
+        elif self.format == "json":
+            self.previous = load_previous_results(output_path)
+            self.items = {}
+        else:
+            raise ValueError(f"Unsupported output format: {self.format}")
+        if self.previous:
+            print(f"Found {len(self.previous)} previous results for {output_path}")
+
+    def write(self, items: List[Dict]):
+        for item in items:
+            if self.format != "json":
+                self.file.write(json.dumps(item, ensure_ascii=False) + "\n")
+                self.pending += 1
+                if self.pending >= self.fsync_every:
+                    self.flush()
+            else:
+                self.items[get_item_key(item)] = item
+
+    def flush(self):
+        if self.format != "json":
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending = 0
+
+    def close(self, data: List[Dict]):
+        keys = [get_item_key(item) for item in data]
+        if self.format == "jsonl":
+            self.flush()
+            self.file.close()
+            compact_jsonl(self.jsonl_path, self.output_path, keys)
+        elif self.format == "arrow":
+            self.flush()
+            self.file.close()
+            offsets = index_jsonl(self.jsonl_path)
+            write_results(self.output_path, lambda: iter_jsonl_items(self.jsonl_path, offsets, keys))
+            # The journal repeats every prompt in every item; once the .arrow file is in place, reruns resume
+            # from it instead.
+            os.remove(self.jsonl_path)
+        else:
+            results = [self.items[key] for key in keys if key in self.items]
+            with open(self.output_path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=4, ensure_ascii=False)
@@ -0,0 +1,118 @@
+from tqdm import tqdm
+from typing import Callable, Dict, List, Optional
+
+from model.backend import GenerationBackend
+from runners.planner import WorkPlanner
+
+
+class LengthBucketScheduler:
+    def __init__(
+            self,
+            generator,
+            model: GenerationBackend,
+            max_batch_size: int = 1,
+            token_budget: Optional[int] = None
+    ):
+        self.generator = generator
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.token_budget = token_budget
+        self.stats = {}
+
+    def prompt_length(self, item: Dict) -> int:
+        # Attribution-based feedback has no prompt; those items keep their input order.
+        get_prompt = getattr(self.generator.generator, "get_prompt", None)
+        if get_prompt is None:
+            return 0
+        return self.model.count_tokens(self.model.get_formatted_prompt(get_prompt(item)))
+
+    def plan(self, lengths: Dict[int, int]) -> List[List[int]]:
+        order = sorted(lengths, key=lambda i: lengths[i])
+
+        batches = []
+        current = []
+        current_max = 0
+        for i in order:
+            new_max = max(current_max, lengths[i])
+            over_size = len(current) >= self.max_batch_size
+            over_budget = self.token_budget is not None and new_max * (len(current) + 1) > self.token_budget
+            if current and (over_size or over_budget):
+                batches.append(current)
+                current = []
+                new_max = lengths[i]
+            current.append(i)
+            current_max = new_max
+        if current:
+            batches.append(current)
+        return batches
+
+    def run(
+            self,
+            data: List[Dict],
+            desc: str,
+            on_batch: Optional[Callable[[List[Dict]], None]] = None,
+            previous: Optional[Dict] = None
+    ) -> List[Dict]:
+        results = [None] * len(data)
+
+        planner = WorkPlanner(self.generator, self.model)
+        work = planner.plan(data, previous or {})
+        planner.report(work, desc)
+
+        skipped = work["skipped"]
+        if skipped:
+            self.generator.call_batch([data[i] for i in skipped])
+            for i in skipped:
+                results[i] = data[i]
+            if on_batch is not None:
+                on_batch([data[i] for i in skipped])
+
+        # Items whose previous result was produced from the same inputs are copied forward.
+        reused = list(work["reused"])
+        for i, previous_result in work["reused"].items():
+            data[i][self.generator.stage] = previous_result
+            results[i] = data[i]
+        if reused and on_batch is not None:
+            on_batch([data[i] for i in reused])
+
+        # Cached items are batched first: they are served from the generation cache, so the weights are
+        # only loaded once the first batch that really needs generation comes up.
+        lengths = {i: self.prompt_length(data[i]) for i in work["cached"] + work["generate"]}
+        batches = (
+            self.plan({i: lengths[i] for i in work["cached"]})
+            + self.plan({i: lengths[i] for i in work["generate"]})
+        )
+
+        real_tokens = 0
+        padded_tokens = 0
+        with tqdm(total=len(data), initial=len(skipped) + len(reused), desc=desc) as pbar:
+            for batch_indices in batches:
+                batch = [data[i] for i in batch_indices]
+                outputs = self.generator.call_batch(batch)
+                for i, output in zip(batch_indices, outputs):
+                    results[i] = output
+                if on_batch is not None:
+                    on_batch(outputs)
+
+                batch_lengths = [lengths[i] for i in batch_indices]
+                real_tokens += sum(batch_lengths)
+                padded_tokens += max(batch_lengths) * len(batch_lengths)
+                pbar.update(len(batch))
+
+        self.stats = {
+            "items": len(data),
+            "skipped": len(skipped),
+            "reused": len(reused),
+            "cached": len(work["cached"]),
+            "generated": len(work["generate"]),
+            "batches": len(batches),
+            "real_tokens": real_tokens,
+            "padded_tokens": padded_tokens,
+            "padding_efficiency": real_tokens / padded_tokens if padded_tokens else 1.0
+        }
+        print(
+            f"[{desc}] {self.stats['batches']} batches, "
+            f"padding efficiency {self.stats['padding_efficiency'] * 100:.2f}% "
+            f"({real_tokens} real / {padded_tokens} padded prompt tokens)"
+        )
+        return results
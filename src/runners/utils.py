@@ -1,6 +1,10 @@
 import sys
 from omegaconf import OmegaConf, DictConfig
 
+from model.backend import GenerationBackend, DRAFT_MODELS
+from model.model import GenerationModel
+from model.openai_backend import OpenAICompatibleBackend
+
 
 def load_config() -> DictConfig:
     config_path = None
@@ -16,3 +20,65 @@ def load_config() -> DictConfig:
     cli = OmegaConf.from_cli()
     merged = OmegaConf.merge(base, cli)
     return merged
+
+
+
+def load_model(config: DictConfig) -> GenerationBackend:
+    if config.model.backend == "openai":
+        return OpenAICompatibleBackend(
+            config.model.name,
+            base_url=config.model.openai.base_url,
+            api_key=config.model.openai.api_key,
+            served_model=config.model.openai.served_model,
+            load_tokenizer=config.model.openai.load_tokenizer,
+            max_workers=config.model.openai.max_workers,
+            timeout=config.model.openai.timeout,
+            cache_path=config.model.cache_path,
+            cache_max_entries=config.model.cache_max_entries
+        )
+    elif config.model.backend != "hf":
+        raise ValueError(f"Unknown model backend: {config.model.backend}")
+    
+    draft_model_id = None
+    if config.model.draft.enabled:
+        draft_model_id = config.model.draft.name or DRAFT_MODELS.get(config.model.name)
+        if draft_model_id is None:
+            raise ValueError(f"No draft model for {config.model.name}; set model.draft.name")
+    
+    return GenerationModel(
+        config.model.name,
+        prefix_cache_size=config.model.prefix_cache_size,
+        cache_path=config.model.cache_path,
+        cache_max_entries=config.model.cache_max_entries,
+        dtype=config.model.dtype,
+        device_map=config.model.device_map,
+        engine_max_batch_size=config.model.engine.max_batch_size if config.model.engine.enabled else 0,
+        draft_model_id=draft_model_id,
+        num_assistant_tokens=config.model.draft.num_assistant_tokens
+    )
+
+
+def report_cache_stats(model: GenerationBackend):
+    if model.generation_cache is not None:
+        model.generation_cache.flush()
+        stats = model.generation_cache.stats()
+        print(
+            f"[generation cache] {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate'] * 100:.2f}%), {stats['size']} entries"
+        )
+    if model.prefix_cache is not None:
+        print(f"[prefix cache] {model.prefix_cache.hits} hits, {model.prefix_cache.misses} misses")
+    if model.is_loaded and model.engine is not None:
+        stats = model.engine.stats
+        mean_rows = stats['row_steps'] / stats['steps'] if stats['steps'] else 0.0
+        print(
+            f"[engine] {stats['requests']} requests, {stats['generated_tokens']} tokens in {stats['busy_time']:.1f}s "
+            f"({model.engine.tokens_per_second():.1f} tokens/s), {mean_rows:.1f} rows per step"
+        )
+    if model.is_loaded and model.draft_stats is not None and model.draft_stats["sequences"]:
+        stats = model.draft_stats
+        print(
+            f"[draft] {stats['sequences']} sequences, {stats['generated_tokens']} tokens in "
+            f"{stats['target_forwards']} target passes ({stats['generated_tokens'] / max(1, stats['target_forwards']):.2f} "
+            f"tokens/pass), ~{model.draft_acceptance_rate() * 100:.1f}% of drafted tokens accepted (estimated)"
+        )